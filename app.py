@@ -1,86 +1,332 @@
 import os
-import spacy
 import datetime
-import requests
 import random
 import json
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
+import uuid
+import atexit
+import logging
+import threading
+import gc
+import copy
+import hashlib
 
-from flask import Flask, request, render_template, session, redirect, url_for
+from flask import Flask, request, render_template, session, redirect, url_for, jsonify, g
 from flask.sessions import SecureCookieSessionInterface # For session management
 
-# --- NLTK Data Download (Run once if needed) ---
-# To ensure 'vader_lexicon' is downloaded, you might need to run this outside the Flask app context once:
-# python -c "import nltk; nltk.download('vader_lexicon')"
-try:
-    _ = nltk.data.find('sentiment/vader_lexicon.zip')
-except LookupError:
-    print("NLTK 'vader_lexicon' not found. Attempting to download...")
-    nltk.download('vader_lexicon')
-    print("NLTK 'vader_lexicon' downloaded.")
+from weather_client import WeatherClient
+from weather_prefetch import WeatherPrefetcher
+from preference_store import PreferenceStore, LEGACY_USER_ID
+from session_store import ServerSideSessionInterface, MemorySessionBackend, SQLiteSessionBackend
+from nlu_cache import NLUCache, normalize_message
+from entity_rules import CityGazetteer, find_date, find_time, parse_date, parse_time
+import metrics
+
+# --- Instrumentation ---
+# Stage timings and counters are exposed on /metrics. METRICS_ENABLED=0 turns the
+# hooks into no-ops. REQUEST_TIMING_LOG=<path> (or "-" for stderr) also writes one
+# JSON line per request with its stage breakdown.
+metrics.enabled = os.environ.get("METRICS_ENABLED", "1") != "0"
+# Set by gunicorn.conf.py: workers share their metrics through snapshot files there
+metrics.multiprocess_dir = os.environ.get("METRICS_MULTIPROCESS_DIR")
+REQUEST_TIMING_LOG = os.environ.get("REQUEST_TIMING_LOG")
+
+timing_logger = logging.getLogger("chat.timing")
+timing_logger.propagate = False
+if REQUEST_TIMING_LOG:
+    timing_handler = logging.StreamHandler() if REQUEST_TIMING_LOG == "-" else logging.FileHandler(REQUEST_TIMING_LOG)
+    timing_handler.setFormatter(logging.Formatter("%(message)s"))
+    timing_logger.addHandler(timing_handler)
+    timing_logger.setLevel(logging.INFO)
 
 # --- Initialize Flask App ---
 app = Flask(__name__)
+SECRET_KEY_FILE = os.environ.get("SECRET_KEY_FILE", ".secret_key")
+
+def load_secret_key():
+    """
+    Returns a secret key that is the same in every worker process: SECRET_KEY from
+    the environment if set, otherwise a random key generated once and kept in
+    SECRET_KEY_FILE (a per-process os.urandom key would break sessions across workers).
+    """
+    if os.environ.get("SECRET_KEY"):
+        return os.environ["SECRET_KEY"]
+    try:
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(SECRET_KEY_FILE, 'rb') as f:
+            return f.read()
+    key = os.urandom(24) # Generates a random 24-byte key for security
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
 # IMPORTANT: Set a secret key for session management!
 # This should be a long, random string. NEVER share this publicly.
-app.secret_key = os.urandom(24) # Generates a random 24-byte key for security
+app.secret_key = load_secret_key()
+
+# Session data (chat history, conversation context) is kept server-side; the cookie
+# only carries a session id. "memory" is per-process, "sqlite" is shared by workers.
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", 10000)) # LRU bound for the memory backend
+SESSION_DB_FILE = os.environ.get("SESSION_DB_FILE", "sessions.db")
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", 50)) # Ring buffer depth per session
+
+# JSON API: default nlp.pipe batch size and the most messages one batch call may carry
+API_BATCH_SIZE = int(os.environ.get("API_BATCH_SIZE", 64))
+API_BATCH_MAX_MESSAGES = int(os.environ.get("API_BATCH_MAX_MESSAGES", 1000))
+
+if SESSION_BACKEND == "sqlite":
+    session_backend = SQLiteSessionBackend(SESSION_DB_FILE)
+elif SESSION_BACKEND == "memory":
+    session_backend = MemorySessionBackend(SESSION_MAX_ENTRIES)
+else:
+    raise ValueError(f"Unknown SESSION_BACKEND '{SESSION_BACKEND}' (expected 'memory' or 'sqlite')")
+app.session_interface = ServerSideSessionInterface(session_backend)
 
 # --- Global Configurations and Initializations (loaded once when app starts) ---
-analyzer = SentimentIntensityAnalyzer() # Initialize VADER sentiment analyzer
+OPENWEATHERMAP_API_KEY = os.environ.get("OPENWEATHERMAP_API_KEY", "2f63df4ee626ff5667b0f2939c3c33ee") # YOUR API KEY
+BASE_WEATHER_URL = os.environ.get("OPENWEATHERMAP_BASE_URL", "http://api.openweathermap.org/data/2.5/weather")
+# Legacy single-user preferences file, migrated once into PREFERENCE_DB_FILE ("" skips the migration)
+USER_DATA_FILE = os.environ.get("USER_DATA_FILE", "user_data.json")
+PREFERENCE_DB_FILE = os.environ.get("PREFERENCE_DB_FILE", "user_data.db") # SQLite store for per-user preferences
+USER_ID_COOKIE = "user_id" # Long-lived cookie identifying a user across chat sessions
 
-OPENWEATHERMAP_API_KEY = "2f63df4ee626ff5667b0f2939c3c33ee" # YOUR API KEY
-BASE_WEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
-USER_DATA_FILE = "user_data.json" # File to store persistent user preferences
+# user_id (the browser's `user_id` cookie) of the person who used the single-user version;
+# their migrated preferences are only handed over when this names them
+LEGACY_PREFERENCES_USER_ID = os.environ.get("LEGACY_PREFERENCES_USER_ID")
+
+preference_store = PreferenceStore(PREFERENCE_DB_FILE, legacy_json_path=USER_DATA_FILE)
+if LEGACY_PREFERENCES_USER_ID:
+    preference_store.claim_legacy(LEGACY_PREFERENCES_USER_ID)
+atexit.register(preference_store.close)
+
+# Weather cache tuning (seconds / entries), overridable from the environment
+WEATHER_CACHE_TTL = float(os.environ.get("WEATHER_CACHE_TTL", 600))
+WEATHER_NEGATIVE_CACHE_TTL = float(os.environ.get("WEATHER_NEGATIVE_CACHE_TTL", 60))
+WEATHER_CACHE_MAX_ENTRIES = int(os.environ.get("WEATHER_CACHE_MAX_ENTRIES", 1024))
+WEATHER_CONNECT_TIMEOUT = float(os.environ.get("WEATHER_CONNECT_TIMEOUT", 3.05))
+WEATHER_READ_TIMEOUT = float(os.environ.get("WEATHER_READ_TIMEOUT", 5))
+# Multi-city turns: worker pool size and the overall time budget for one turn
+WEATHER_MAX_WORKERS = int(os.environ.get("WEATHER_MAX_WORKERS", 8))
+WEATHER_TURN_DEADLINE = float(os.environ.get("WEATHER_TURN_DEADLINE", 4))
+# Circuit breaker: consecutive failures before opening, seconds before a retry
+WEATHER_FAILURE_THRESHOLD = int(os.environ.get("WEATHER_FAILURE_THRESHOLD", 5))
+WEATHER_RESET_TIMEOUT = float(os.environ.get("WEATHER_RESET_TIMEOUT", 30))
+
+weather_client = WeatherClient(
+    OPENWEATHERMAP_API_KEY,
+    BASE_WEATHER_URL,
+    cache_ttl=WEATHER_CACHE_TTL,
+    negative_ttl=WEATHER_NEGATIVE_CACHE_TTL,
+    max_entries=WEATHER_CACHE_MAX_ENTRIES,
+    connect_timeout=WEATHER_CONNECT_TIMEOUT,
+    read_timeout=WEATHER_READ_TIMEOUT,
+    max_workers=WEATHER_MAX_WORKERS,
+    failure_threshold=WEATHER_FAILURE_THRESHOLD,
+    reset_timeout=WEATHER_RESET_TIMEOUT,
+)
+
+# Background refresh of preferred and recently requested cities, so most weather
+# turns are cache hits. Started per serving process by start_weather_prefetcher().
+WEATHER_PREFETCH_ENABLED = os.environ.get("WEATHER_PREFETCH_ENABLED", "1") != "0"
+WEATHER_PREFETCH_INTERVAL = float(os.environ.get("WEATHER_PREFETCH_INTERVAL", 60))
+# Refresh entries expiring within this many seconds (keep it above the interval)
+WEATHER_PREFETCH_REFRESH_AHEAD = float(os.environ.get("WEATHER_PREFETCH_REFRESH_AHEAD", 120))
+WEATHER_PREFETCH_MAX_RATE = float(os.environ.get("WEATHER_PREFETCH_MAX_RATE", 2)) # upstream calls per second, all workers together
+WEATHER_PREFETCH_JITTER = float(os.environ.get("WEATHER_PREFETCH_JITTER", 0.1))
+WEATHER_PREFETCH_RECENT_TTL = float(os.environ.get("WEATHER_PREFETCH_RECENT_TTL", 3600))
+WEATHER_PREFETCH_MAX_CITIES = int(os.environ.get("WEATHER_PREFETCH_MAX_CITIES", 200))
+
+def preferred_weather_cities():
+    """Every city some user saved as their preferred weather city."""
+    return {city for city in preference_store.values_for("preferred_weather_city") if isinstance(city, str)}
+
+weather_prefetcher = WeatherPrefetcher(
+    weather_client,
+    city_source=preferred_weather_cities,
+    interval=WEATHER_PREFETCH_INTERVAL,
+    refresh_ahead=WEATHER_PREFETCH_REFRESH_AHEAD,
+    max_rate=WEATHER_PREFETCH_MAX_RATE,
+    jitter=WEATHER_PREFETCH_JITTER,
+    recent_ttl=WEATHER_PREFETCH_RECENT_TTL,
+    max_cities=WEATHER_PREFETCH_MAX_CITIES,
+)
+
+def start_weather_prefetcher(process_count=1):
+    """
+    Starts the prefetch thread in this process if enabled (call after forking,
+    see gunicorn.conf.py). Each of `process_count` serving processes refreshes
+    its own cache, so they split WEATHER_PREFETCH_MAX_RATE between them.
+    """
+    if WEATHER_PREFETCH_ENABLED:
+        weather_prefetcher.max_rate = WEATHER_PREFETCH_MAX_RATE / max(1, process_count)
+        weather_prefetcher.start()
 
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Downloading spaCy model 'en_core_web_sm' for the first time...")
-    spacy.cli.download("en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
+# --- Model Loading ---
+# spaCy and VADER are loaded by load_models(), not at import time, and are never
+# downloaded at runtime: install them at build time with
+#   python -m spacy download en_core_web_sm
+#   python -m nltk.downloader vader_lexicon
+# Serving processes call init_models() to load in the background; /healthz answers
+# immediately and /readyz only reports ready after a warm-up parse.
+SPACY_MODEL = os.environ.get("SPACY_MODEL", "en_core_web_sm")
+# Shared cache of NLU results for short, frequently repeated messages ("yes", "help", ...).
+# NLU_CACHE_FILE persists it across restarts; it is discarded when the keywords or model change.
+NLU_CACHE_MAX_ENTRIES = int(os.environ.get("NLU_CACHE_MAX_ENTRIES", 5000))
+NLU_CACHE_MAX_TEXT_LENGTH = int(os.environ.get("NLU_CACHE_MAX_TEXT_LENGTH", 64))
+NLU_CACHE_FILE = os.environ.get("NLU_CACHE_FILE")
+# Pipeline components we never read from: intent matching only needs the text and
+# entity extraction only needs NER, so skip the parser and the lemmatizer chain.
+NLU_DISABLED_COMPONENTS = ["parser", "lemmatizer", "attribute_ruler"]
+WARMUP_TEXT = "Hello! What's the weather in London? Schedule a meeting tomorrow at 3 PM, thanks."
+
+nlp = None            # spaCy pipeline
+analyzer = None       # VADER sentiment analyzer
+intent_matcher = None # Compiled PhraseMatcher over intent_keywords
+nlu_cache = NLUCache(NLU_CACHE_MAX_ENTRIES, NLU_CACHE_MAX_TEXT_LENGTH, NLU_CACHE_FILE)
+models_ready = threading.Event()
+model_load_error = None
+_model_load_lock = threading.Lock()   # serializes load_models()
+_model_thread_lock = threading.Lock() # guards starting the background loader
+_model_load_thread = None
+
+class ModelsNotAvailable(RuntimeError):
+    """Raised when a required model or data package is not installed."""
+
+def load_models():
+    """
+    Loads spaCy and VADER, compiles the intent matcher and runs a warm-up parse.
+    Safe to call repeatedly; raises ModelsNotAvailable instead of downloading anything.
+    """
+    global nlp, analyzer
+    with _model_load_lock:
+        if models_ready.is_set():
+            return
+        import spacy
+        import nltk
+        from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+        try:
+            nltk.data.find('sentiment/vader_lexicon.zip')
+        except LookupError:
+            raise ModelsNotAvailable("NLTK 'vader_lexicon' is not installed. Run: python -m nltk.downloader vader_lexicon")
+        try:
+            loaded_nlp = spacy.load(SPACY_MODEL, disable=NLU_DISABLED_COMPONENTS)
+        except OSError:
+            raise ModelsNotAvailable(f"spaCy model '{SPACY_MODEL}' is not installed. Run: python -m spacy download {SPACY_MODEL}")
+
+        nlp = loaded_nlp
+        analyzer = SentimentIntensityAnalyzer() # Initialize VADER sentiment analyzer
+        reload_intent_keywords()
+        if nlu_cache.load():
+            print(f"Restored {nlu_cache.stats()['size']} cached NLU results from {NLU_CACHE_FILE}.")
+
+        # Warm-up: first calls allocate lazily-built tables, keep that off user requests
+        nlp(WARMUP_TEXT)
+        analyzer.polarity_scores(WARMUP_TEXT)
+        models_ready.set()
+
+def init_models(background=True):
+    """
+    Starts loading models. In the background by default, so the server can
+    answer health checks while spaCy loads; failures are kept in model_load_error.
+    """
+    global _model_load_thread
+    if models_ready.is_set():
+        return
+    if not background:
+        load_models()
+        return
+    with _model_thread_lock:
+        if _model_load_thread is not None:
+            return
+        _model_load_thread = threading.Thread(target=_load_models_in_background, name="model-loader", daemon=True)
+        _model_load_thread.start()
+
+def create_app():
+    """
+    App factory for production serving (see gunicorn.conf.py).
+    Loads the models synchronously so that with preload_app the parent process
+    holds the only copy, then freezes the GC so forked workers share those pages
+    copy-on-write instead of touching them during collections.
+    """
+    load_models()
+    gc.collect()
+    gc.freeze()
+    return app
+
+def _load_models_in_background():
+    global model_load_error
+    started = datetime.datetime.now()
+    try:
+        load_models()
+        print(f"Models loaded and warmed up in {(datetime.datetime.now() - started).total_seconds():.2f}s.")
+    except Exception as e:
+        model_load_error = str(e)
+        print(f"Model loading failed: {e}")
 
 # --- Helper Functions (from your original agent.py) ---
 
 def get_current_weather(city):
-    """Fetches current weather data for a given city from OpenWeatherMap API."""
-    params = {
-        "q": city,
-        "appid": OPENWEATHERMAP_API_KEY,
-        "units": "metric"
-    }
-    try:
-        response = requests.get(BASE_WEATHER_URL, params=params)
-        response.raise_for_status()
-        weather_data = response.json()
-
-        if weather_data.get("cod") == 200:
-            temp = weather_data["main"]["temp"]
-            conditions = weather_data["weather"][0]["description"]
-            city_name = weather_data["name"]
-            return {"city": city_name, "temperature": f"{temp}°C", "conditions": conditions}
-        else:
-            print(f"OpenWeatherMap API error for {city}: {weather_data.get('message', 'Unknown error')}")
-            return {"city": city, "temperature": "N/A", "conditions": "unknown"}
-    except requests.exceptions.RequestException as e:
-        print(f"Network or API Key Error fetching weather data for {city}: {e}")
-        return {"city": city, "temperature": "N/A", "conditions": "error"}
-
-def load_user_data():
-    """Loads user preferences from a JSON file."""
-    try:
-        with open(USER_DATA_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        print(f"Warning: {USER_DATA_FILE} is corrupted or empty. Starting with fresh data.")
-        return {}
-
-def save_user_data(data):
-    """Saves user preferences to a JSON file."""
-    with open(USER_DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    """Fetches current weather data for a given city (cached, see weather_client.py)."""
+    with metrics.span("weather"):
+        weather_data = weather_client.get_weather(city)
+    if weather_data["temperature"] != "N/A":
+        weather_prefetcher.track(weather_data["city"])
+    return weather_data
+
+def get_weather_for_cities(cities):
+    """
+    Fetches several cities concurrently within WEATHER_TURN_DEADLINE seconds.
+    Returns (results, timed_out) like WeatherClient.get_weather_many.
+    """
+    with metrics.span("weather"):
+        results, timed_out = weather_client.get_weather_many(cities, WEATHER_TURN_DEADLINE)
+    for weather_data in results:
+        if weather_data["temperature"] != "N/A":
+            weather_prefetcher.track(weather_data["city"])
+    return results, timed_out
+
+def unrecognized_cities_note(entities):
+    """Sentence naming the places extract_entities() couldn't match to a city ("" if none)."""
+    names = entities.get("unrecognized_cities")
+    if not names:
+        return ""
+    return f" I don't know a city called {' or '.join(names)}."
+
+def load_user_data(user_id):
+    """Loads one user's preferences (served from the store's in-memory cache when warm)."""
+    with metrics.span("preferences.load"):
+        return preference_store.load(user_id)
+
+def save_user_data(data, user_id):
+    """Saves one user's preferences; only keys that changed are written on the next flush."""
+    preference_store.save(user_id, data)
+
+def append_chat_message(sender, message):
+    """
+    Appends to session['chat_history'], dropping the oldest entries so at most
+    CHAT_HISTORY_MAX_MESSAGES are kept (a fixed-size ring buffer).
+    Each entry gets an increasing "seq" number that survives trimming, which
+    is what /chat/turn clients use as their cursor.
+    """
+    seq = session.get('chat_seq', 0) + 1
+    session['chat_seq'] = seq
+    chat_history = session['chat_history']
+    chat_history.append({"seq": seq, "sender": sender, "message": message})
+    overflow = len(chat_history) - CHAT_HISTORY_MAX_MESSAGES
+    if overflow > 0:
+        del chat_history[:overflow]
+    session.modified = True
+
+def get_user_id():
+    """Returns the current browser's user id, minting one (and its cookie) on first visit."""
+    user_id = request.cookies.get(USER_ID_COOKIE)
+    if not user_id or user_id == LEGACY_USER_ID:
+        user_id = g.get("new_user_id")
+        if not user_id:
+            user_id = g.new_user_id = uuid.uuid4().hex
+    return user_id
 
 # Static knowledge base and predefined responses
 static_knowledge = {
@@ -122,37 +368,239 @@ intent_keywords = {
     "set_preferred_city": ["set my city", "my city is", "remember my city"]
 }
 
-def recognize_intent_spacy(user_input):
+# --- Entity Fast Path ---
+# Cities are looked up in a gazetteer and dates/times matched by compiled patterns
+# (entity_rules.py); spaCy's NER only runs for what those miss.
+CITY_GAZETTEER_FILE = os.environ.get(
+    "CITY_GAZETTEER_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.txt"))
+city_gazetteer = CityGazetteer.from_file(CITY_GAZETTEER_FILE)
+
+class MessageAnalysis:
+    """
+    Per-turn NLU state for one user message.
+    The message is run through the spaCy pipeline at most once and the
+    resulting entities are shared by intent recognition, entity extraction
+    and the context fallbacks in generate_response. When the message came
+    from the NLU cache, `cache_entry` is filled in with anything computed
+    later (entity spans, sentiment) so the next identical message skips it.
+    """
+    def __init__(self, text, doc=None, cache_entry=None, tokens=None):
+        self.text = text
+        self._doc = doc
+        self._tokens = doc if doc is not None else tokens
+        self.cache_entry = cache_entry
+        self._entity_spans = cache_entry.get("entity_spans") if cache_entry else None
+        self._sentiment = cache_entry.get("sentiment") if cache_entry else None
+        self._cities = None
+        self._unrecognized_cities = None
+        self._meeting_details = None
+
+    @property
+    def tokens(self):
+        """Tokenizer-only Doc; enough for keyword matching, no pipeline run."""
+        if self._tokens is None:
+            with metrics.span("nlu.tokenize"):
+                self._tokens = nlp.make_doc(self.text)
+        return self._tokens
+
+    @property
+    def doc(self):
+        """Fully processed Doc, reusing the tokenization if it already exists."""
+        if self._doc is None:
+            tokens = self.tokens
+            metrics.count("spacy_pipeline_runs")
+            with metrics.span("nlu.parse"):
+                self._doc = nlp(tokens)
+        return self._doc
+
+    @property
+    def entity_spans(self):
+        """Named entities as (text, label) pairs."""
+        if self._entity_spans is None:
+            self._entity_spans = [(ent.text, ent.label_) for ent in self.doc.ents]
+            if self.cache_entry is not None:
+                self.cache_entry["entity_spans"] = self._entity_spans
+        return self._entity_spans
+
+    @property
+    def cities(self):
+        """
+        Cities mentioned, from the gazetteer. NER (GPE) adds to them when the
+        gazetteer finds none or leaves listed names unmatched ("Paris and Atlantis").
+        """
+        if self._cities is None:
+            self._find_cities()
+        return self._cities
+
+    @property
+    def unrecognized_cities(self):
+        """Names listed like places that neither the gazetteer nor NER took for a city."""
+        if self._cities is None:
+            self._find_cities()
+        return self._unrecognized_cities
+
+    def _find_cities(self):
+        cities = city_gazetteer.find(self.text)
+        unmatched = city_gazetteer.unmatched(self.text)
+        if cities and not unmatched:
+            metrics.count("entity_fast_path")
+        else:
+            metrics.count("entity_ner_fallback")
+            known = {city.casefold() for city in cities}
+            for text, label in self.entity_spans:
+                if label == "GPE" and text.casefold() not in known:
+                    known.add(text.casefold())
+                    cities.append(text)
+        self._unrecognized_cities = [name for name in unmatched
+                                     if not any(name.casefold() in city.casefold() for city in cities)]
+        self._cities = cities
+
+    @property
+    def meeting_details(self):
+        """(date, time) as written by the user, either may be None; NER fills in only what the patterns miss."""
+        if self._meeting_details is None:
+            date, time = find_date(self.text), find_time(self.text)
+            if date and time:
+                metrics.count("entity_fast_path")
+            else:
+                metrics.count("entity_ner_fallback")
+                ner_date = ner_time = None
+                for text, label in self.entity_spans:
+                    if label == "DATE":
+                        ner_date = text
+                    if label == "TIME":
+                        ner_time = text
+                date, time = date or ner_date, time or ner_time
+            self._meeting_details = (date, time)
+        return self._meeting_details
+
+    @property
+    def sentiment(self):
+        """VADER sentiment label, computed on first use."""
+        if self._sentiment is None:
+            metrics.count("vader_calls")
+            with metrics.span("sentiment"):
+                self._sentiment = get_sentiment(self.text)
+            if self.cache_entry is not None:
+                self.cache_entry["sentiment"] = self._sentiment
+        return self._sentiment
+
+def nlu_fingerprint():
+    """Identifies the keyword table and model an NLU result was computed with."""
+    source = json.dumps({
+        "intent_keywords": intent_keywords,
+        "model": f"{nlp.meta.get('lang')}_{nlp.meta.get('name')}-{nlp.meta.get('version')}",
+        "pipeline": nlp.pipe_names,
+        "gazetteer": city_gazetteer.fingerprint,
+    }, sort_keys=True)
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+def analyze_message(user_input, doc=None, tokens=None):
+    """
+    Builds the MessageAnalysis for a turn and resolves intent and entities from it.
+    Short messages are served from the shared NLU cache when possible.
+    `doc` is an already parsed Doc, `tokens` a tokenizer-only one (parsed only if needed).
+    Returns (analysis, intent, confidence, entities).
+    """
+    key = normalize_message(user_input)
+    cacheable = nlu_cache.cacheable(key)
+    if cacheable:
+        entry = nlu_cache.get(key)
+        if entry is not None:
+            analysis = MessageAnalysis(user_input, doc, cache_entry=entry, tokens=tokens)
+            return analysis, entry["intent"], entry["confidence"], copy.deepcopy(entry["entities"])
+
+    entry = {"entity_spans": None, "sentiment": None} if cacheable else None
+    analysis = MessageAnalysis(user_input, doc, cache_entry=entry, tokens=tokens)
+    intent, confidence = recognize_intent_spacy(user_input, analysis)
+    with metrics.span("nlu.entities"):
+        entities = extract_entities(user_input, intent, analysis)
+    if cacheable:
+        entry.update(intent=intent, confidence=confidence, entities=copy.deepcopy(entities))
+        nlu_cache.put(key, entry)
+    return analysis, intent, confidence, entities
+
+def reload_intent_keywords():
+    """Recompiles the intent matcher after intent_keywords changes and drops stale cached NLU results."""
+    global intent_matcher, intent_order
+    intent_matcher = build_intent_matcher(intent_keywords)
+    intent_order = {intent: rank for rank, intent in enumerate(intent_keywords)}
+    nlu_cache.set_fingerprint(nlu_fingerprint())
+
+def build_intent_matcher(keywords_by_intent):
+    """
+    Compiles the keyword table into a single PhraseMatcher (case-insensitive,
+    token boundaries). Call again whenever intent_keywords changes.
+    """
+    from spacy.matcher import PhraseMatcher
+    matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
+    for intent, keywords in keywords_by_intent.items():
+        matcher.add(intent, list(nlp.tokenizer.pipe(keywords)))
+    return matcher
+
+# Intents that ask the bot to do something; they outrank greetings, thanks and help in one message
+TASK_INTENTS = {"get_weather", "schedule_meeting", "set_preferred_city", "get_current_year"}
+
+# Tie-break order for recognize_intent_spacy; the matcher itself is built in load_models().
+# Threaded workers share intent_matcher, nlp and analyzer read-only; rebuilding the
+# matcher swaps the global in one assignment, so in-flight requests never see a half-built one.
+intent_order = {intent: rank for rank, intent in enumerate(intent_keywords)}
+
+def recognize_intent_spacy(user_input, analysis=None):
     """
     Recognizes the user's intent based on keywords in the input.
-    Returns the intent name and a simple confidence score.
+    Task intents (TASK_INTENTS) win over small talk in the same message, so
+    "weather in London, thank you" is a weather request. Within each group,
+    intents are scored by how many distinct keywords they match (a long phrase
+    like "help me" counts once); ties go to the intent listed first.
+    Returns the intent name and a confidence between 0.5 and 1.0 (the share
+    of the message's words the winning intent's keywords cover).
     """
-    doc = nlp(user_input.lower())
-    for intent, keywords in intent_keywords.items():
-        for keyword in keywords:
-            if keyword in doc.text:
-                return intent, 1.0
-    return "unknown", 0.5
+    if analysis is None:
+        analysis = MessageAnalysis(user_input)
+    tokens = analysis.tokens
+    word_count = sum(1 for token in tokens if not (token.is_punct or token.is_space))
+    if word_count == 0:
+        return "unknown", 0.5
+
+    covered, keywords = {}, {}
+    with metrics.span("nlu.intent"):
+        matches = intent_matcher(tokens)
+    for match_id, start, end in matches:
+        intent = nlp.vocab.strings[match_id]
+        covered.setdefault(intent, set()).update(range(start, end))
+        keywords.setdefault(intent, set()).add(tokens[start:end].text.lower())
+    if not covered:
+        return "unknown", 0.5
+
+    best_intent = max(covered, key=lambda intent: (intent in TASK_INTENTS, len(keywords[intent]),
+                                                    -intent_order[intent]))
+    coverage = min(1.0, len(covered[best_intent]) / word_count)
+    return best_intent, 0.5 + 0.5 * coverage
 
-def extract_entities(user_input, intent):
+def extract_entities(user_input, intent, analysis=None):
     """
     Extracts relevant entities (like city, date, time) from user input
-    based on the recognized intent using spaCy's NER.
+    based on the recognized intent. The gazetteer and date/time patterns are
+    tried first; spaCy's NER only runs for what they miss.
     """
-    doc = nlp(user_input)
+    if analysis is None:
+        analysis = MessageAnalysis(user_input)
     entities = {}
 
     if intent == "get_weather":
-        for ent in doc.ents:
-            if ent.label_ == "GPE":
-                entities["city"] = ent.text
-                break
+        cities = list(analysis.cities)
+        if cities:
+            entities["city"] = cities[0]
+            entities["cities"] = cities
+        if analysis.unrecognized_cities:
+            entities["unrecognized_cities"] = list(analysis.unrecognized_cities)
     elif intent == "schedule_meeting":
-        for ent in doc.ents:
-            if ent.label_ == "DATE":
-                entities["date"] = ent.text
-            if ent.label_ == "TIME":
-                entities["time"] = ent.text
+        date, time = analysis.meeting_details
+        if date:
+            entities["date"] = date
+        if time:
+            entities["time"] = time
     return entities
 
 def get_sentiment(text):
@@ -169,24 +617,47 @@ def get_sentiment(text):
         return 'neutral'
 
 # --- Main Response Generation Logic ---
-def generate_response(user_input, intent, entities=None, user_prefs=None, confidence=1.0):
+
+def propose_meeting(conversation_context, date, time):
+    """
+    Asks the user to confirm a meeting. The date and time are kept as written
+    and also normalized (ISO date, 24-hour time) when the patterns understand
+    them, so relative dates like "tomorrow" are pinned down at this point.
+    """
+    date_value, time_value = parse_date(date), parse_time(time)
+    conversation_context["awaiting_confirmation"] = "schedule_meeting"
+    conversation_context["pending_schedule_date"] = date
+    conversation_context["pending_schedule_time"] = time
+    conversation_context["pending_schedule_at"] = {
+        "date": date_value.isoformat() if date_value else None,
+        "time": time_value,
+    }
+    if date_value and time_value:
+        return f"I will schedule a meeting for {date} at {time} ({date_value:%A, %B} {date_value.day}, {time_value}). Does that sound correct? (Yes/No)"
+    return f"I will schedule a meeting for {date} at {time}. Does that sound correct? (Yes/No)"
+
+def generate_response(user_input, intent, entities=None, user_prefs=None, confidence=1.0, analysis=None, state=None):
     """
     Generates the agent's response based on intent, extracted entities,
     conversation context, user preferences, and confidence.
     Now also considers user sentiment.
+    `state` holds the conversation context; it defaults to Flask's session and
+    the JSON API passes its own per-session dict.
     """
     # Use Flask's session for short-term conversation context (per user)
+    if state is None:
+        state = session
     # If starting a new session, initialize conversation_context
-    if 'conversation_context' not in session:
-        session['conversation_context'] = {"unknown_count": 0}
-    conversation_context = session['conversation_context']
+    if 'conversation_context' not in state:
+        state['conversation_context'] = {"unknown_count": 0}
+    conversation_context = state['conversation_context']
 
     if entities is None:
         entities = {}
     if user_prefs is None:
         user_prefs = {}
-
-    user_sentiment = get_sentiment(user_input)
+    if analysis is None:
+        analysis = MessageAnalysis(user_input)
 
     # --- 1. Handle Confirmation Workflow (Highest Priority) ---
     if conversation_context.get("awaiting_confirmation") == "schedule_meeting":
@@ -195,11 +666,11 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
             date = conversation_context.get("pending_schedule_date")
             time = conversation_context.get("pending_schedule_time")
             response = f"Great! The meeting has been confirmed for {date} at {time}."
-            session['conversation_context'] = {"unknown_count": 0} # Clear context
+            state['conversation_context'] = {"unknown_count": 0} # Clear context
             return response
         elif "no" in user_input_lower or "nope" in user_input_lower or "cancel" in user_input_lower:
             response = "Okay, I've cancelled that scheduling request. Is there something else I can help with?"
-            session['conversation_context'] = {"unknown_count": 0} # Clear context
+            state['conversation_context'] = {"unknown_count": 0} # Clear context
             return response
         else:
             response = "I'm still waiting for your confirmation (Yes/No) for the meeting. Or do you want to cancel?"
@@ -212,7 +683,7 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
             response = static_knowledge["low_confidence_response"]
         elif confidence < 0.8 and conversation_context["unknown_count"] >= 3:
             response = "It seems I'm having a lot of trouble understanding you. Perhaps you could try asking one of my main capabilities? " + static_knowledge["help_response"]
-            session['conversation_context'] = {"unknown_count": 0} # Clear context
+            state['conversation_context'] = {"unknown_count": 0} # Clear context
         else:
             response = static_knowledge["unknown_response"]
     else:
@@ -220,11 +691,32 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
 
 
     # --- 3. Intent-Based Responses (Main Logic) ---
-    if intent == "get_weather":
+    if intent == "get_weather" and len(entities.get("cities", [])) > 1:
+        weather_results, timed_out = get_weather_for_cities(entities["cities"])
+        reports = []
+        for weather_data in weather_results:
+            if weather_data["temperature"] != "N/A":
+                conversation_context["last_weather_city"] = weather_data["city"]
+                reports.append(f"{weather_data['city']} is {weather_data['temperature']} and {weather_data['conditions']}")
+            elif weather_data["conditions"] == "error":
+                timed_out.append(weather_data["city"])
+            else:
+                reports.append(f"I couldn't find {weather_data['city']}")
+        if reports:
+            response = "The current weather in " + "; ".join(reports) + "."
+            if timed_out:
+                response += f" I couldn't get the weather for {', '.join(timed_out)} right now."
+            conversation_context.pop("awaiting_city_for_weather", None)
+        else:
+            response = static_knowledge["api_error_message"]
+        response += unrecognized_cities_note(entities)
+
+    elif intent == "get_weather":
         city = entities.get("city")
-        if not city:
+        # A name we don't know is not a request for the last or preferred city
+        if not city and not entities.get("unrecognized_cities"):
             city = conversation_context.get("last_weather_city")
-        if not city and user_prefs.get("preferred_weather_city"):
+        if not city and not entities.get("unrecognized_cities") and user_prefs.get("preferred_weather_city"):
             city = user_prefs["preferred_weather_city"]
         
         if city:
@@ -237,8 +729,9 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
                 response = static_knowledge["api_error_message"]
             else:
                 response = f"Sorry, I couldn't get the weather for {weather_data['city']}. Is there another city you'd like to check?"
+            response += unrecognized_cities_note(entities)
         else:
-            response = static_knowledge["weather_prompt"]
+            response = (unrecognized_cities_note(entities) + " " + static_knowledge["weather_prompt"]).lstrip()
             conversation_context["awaiting_city_for_weather"] = True
 
     elif intent == "schedule_meeting":
@@ -252,10 +745,7 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
         final_time = conversation_context.get("meeting_time")
 
         if final_date and final_time:
-            response = f"I will schedule a meeting for {final_date} at {final_time}. Does that sound correct? (Yes/No)"
-            conversation_context["awaiting_confirmation"] = "schedule_meeting"
-            conversation_context["pending_schedule_date"] = final_date
-            conversation_context["pending_schedule_time"] = final_time
+            response = propose_meeting(conversation_context, final_date, final_time)
         else:
             conversation_context["awaiting_meeting_details"] = True
             missing_info = []
@@ -271,12 +761,13 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
 
     elif intent == "greet":
         response = random.choice(static_knowledge["greetings_info"])
-        if user_sentiment == 'positive':
+        if analysis.sentiment == 'positive':
             response += " It's great to hear from you!"
-        session['conversation_context'] = {"unknown_count": 0} # Clear context
+        state['conversation_context'] = {"unknown_count": 0} # Clear context
 
     elif intent == "thank_you":
         response = static_knowledge["thank_you_response"]
+        user_sentiment = analysis.sentiment
         if user_sentiment == 'positive':
             response += " Glad I could help!"
         elif user_sentiment == 'negative':
@@ -284,7 +775,7 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
 
     elif intent == "exit":
         response = static_knowledge["goodbye_response"]
-        session['conversation_context'] = {"unknown_count": 0} # Clear context
+        state['conversation_context'] = {"unknown_count": 0} # Clear context
 
     elif intent == "about_agent":
         response = static_knowledge["agent_name"] + ". " + static_knowledge["agent_purpose"] + " " + static_knowledge["developer_info"]
@@ -296,11 +787,11 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
         response = f"The current year is {static_knowledge['current_year']}."
 
     elif intent == "help":
-        if user_sentiment == 'negative':
+        if analysis.sentiment == 'negative':
             response = static_knowledge["reassurance_response"] + " " + static_knowledge["help_response"]
         else:
             response = static_knowledge["help_response"]
-        session['conversation_context'] = {"unknown_count": 0} # Clear context
+        state['conversation_context'] = {"unknown_count": 0} # Clear context
 
     elif intent == "set_preferred_city":
         city = entities.get("city")
@@ -317,48 +808,37 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
           # or if the initial intent was 'unknown' but could be resolved by context.
 
         if conversation_context.get("awaiting_city_for_weather"):
-            new_doc = nlp(user_input)
-            for ent in new_doc.ents:
-                if ent.label_ == "GPE":
-                    city = ent.text
-                    conversation_context["last_weather_city"] = city
-                    conversation_context.pop("awaiting_city_for_weather")
-                    weather_data = get_current_weather(city)
-                    if weather_data["temperature"] != "N/A":
-                        response = f"Got it, the weather in {weather_data['city']} is {weather_data['temperature']} and {weather_data['conditions']}."
-                    elif weather_data["conditions"] == "error":
-                        response = static_knowledge["api_error_message"]
-                    else:
-                        response = f"Sorry, I couldn't get the weather for {weather_data['city']}. Is there another city you'd like to check?"
-                    conversation_context["unknown_count"] = 0
-                    return response
+            if analysis.cities:
+                city = analysis.cities[0]
+                conversation_context["last_weather_city"] = city
+                conversation_context.pop("awaiting_city_for_weather")
+                weather_data = get_current_weather(city)
+                if weather_data["temperature"] != "N/A":
+                    response = f"Got it, the weather in {weather_data['city']} is {weather_data['temperature']} and {weather_data['conditions']}."
+                elif weather_data["conditions"] == "error":
+                    response = static_knowledge["api_error_message"]
+                else:
+                    response = f"Sorry, I couldn't get the weather for {weather_data['city']}. Is there another city you'd like to check?"
+                conversation_context["unknown_count"] = 0
+                return response
             else:
                 response = "Could you please specify the city for the weather?"
                 return response
 
         elif conversation_context.get("awaiting_preferred_city"):
-            new_doc = nlp(user_input)
-            for ent in new_doc.ents:
-                if ent.label_ == "GPE":
-                    city = ent.text
-                    user_prefs["preferred_weather_city"] = city
-                    conversation_context.pop("awaiting_preferred_city")
-                    response = static_knowledge["preferred_city_set_confirm"].format(city=city)
-                    conversation_context["unknown_count"] = 0
-                    return response
+            if analysis.cities:
+                city = analysis.cities[0]
+                user_prefs["preferred_weather_city"] = city
+                conversation_context.pop("awaiting_preferred_city")
+                response = static_knowledge["preferred_city_set_confirm"].format(city=city)
+                conversation_context["unknown_count"] = 0
+                return response
             else:
                 response = "I didn't catch a city. What city would you like to set as your preferred weather city?"
                 return response
 
         elif conversation_context.get("awaiting_meeting_details"):
-            new_doc = nlp(user_input)
-            new_date = None
-            new_time = None
-            for ent in new_doc.ents:
-                if ent.label_ == "DATE":
-                    new_date = ent.text
-                if ent.label_ == "TIME":
-                    new_time = ent.text
+            new_date, new_time = analysis.meeting_details
 
             current_date = conversation_context.get("meeting_date")
             current_time = conversation_context.get("meeting_time")
@@ -367,10 +847,7 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
             final_time = new_time if new_time else current_time
 
             if final_date and final_time:
-                response = f"I will schedule a meeting for {final_date} at {final_time}. Does that sound correct? (Yes/No)"
-                conversation_context["awaiting_confirmation"] = "schedule_meeting"
-                conversation_context["pending_schedule_date"] = final_date
-                conversation_context["pending_schedule_time"] = final_time
+                response = propose_meeting(conversation_context, final_date, final_time)
                 conversation_context["unknown_count"] = 0
                 return response
             else:
@@ -388,56 +865,311 @@ def generate_response(user_input, intent, entities=None, user_prefs=None, confid
 
 # --- Flask Routes ---
 
+def start_chat_history(user_id, user_preferences):
+    """
+    Creates session['chat_history'] with the welcome message if this is a new
+    conversation. Returns True when a new history was started.
+    """
+    if 'chat_history' in session:
+        return False
+    session['chat_history'] = []
+    # Initial welcome message only if first time visiting the app
+    if not user_preferences.get("has_been_welcomed", False):
+        welcome_message = "\nHello! I'm your AI Assistant Prototype. I'm here to help you with some tasks." \
+                          "\nI can get you weather updates, help schedule meetings, and answer some general questions about myself." \
+                          "\nType 'help' if you want to see a list of things I can do." \
+                          "\nLet's get started!"
+        append_chat_message("Agent", welcome_message)
+        user_preferences["has_been_welcomed"] = True
+        save_user_data(user_preferences, user_id)
+    else:
+        append_chat_message("Agent", random.choice(static_knowledge["greetings_info"]) + " What can I do for you today? (Type 'help' for options)")
+    return True
+
+def handle_chat_turn(user_message, user_id, user_preferences):
+    """
+    Runs one browser chat turn and appends it to the history.
+    Returns the history as it stood at the end of the turn (the session is
+    cleared on exit, so callers must not read it back from the session).
+    """
+    append_chat_message("You", user_message)
+
+    # Parse the message once; intent, entities and context fallbacks share the Doc
+    analysis, intent_name, confidence, extracted_entities = analyze_message(user_message)
+
+    with metrics.span("generate_response"):
+        agent_response = generate_response(user_message, intent_name, extracted_entities, user_preferences, confidence, analysis)
+
+    append_chat_message("Agent", agent_response)
+
+    # Record preference changes; only modified keys get written on flush
+    save_user_data(user_preferences, user_id)
+
+    chat_history = session['chat_history']
+    # Handle exit intent - clear session so the next message starts a new conversation
+    if intent_name == "exit":
+        final_goodbye = static_knowledge["goodbye_response"]
+        append_chat_message("Agent", final_goodbye)
+        session.clear() # Clear session for a new conversation on refresh/revisit
+    else:
+        session.modified = True
+    return chat_history
+
 @app.route('/', methods=['GET', 'POST'])
 def chat():
-    user_message = ""
-    agent_response = ""
-    user_preferences = load_user_data() # Load user_data for each request
+    """Full page: renders the whole history. Used on first load and as the no-JavaScript fallback."""
+    user_id = get_user_id()
+    user_preferences = load_user_data(user_id) # Per-user preferences, cached in memory
 
     # Initialize conversation history in session if it doesn't exist
-    if 'chat_history' not in session:
-        session['chat_history'] = []
-        # Initial welcome message only if first time visiting the app
-        if not user_preferences.get("has_been_welcomed", False):
-            welcome_message = "\nHello! I'm your AI Assistant Prototype. I'm here to help you with some tasks." \
-                              "\nI can get you weather updates, help schedule meetings, and answer some general questions about myself." \
-                              "\nType 'help' if you want to see a list of things I can do." \
-                              "\nLet's get started!"
-            session['chat_history'].append({"sender": "Agent", "message": welcome_message})
-            user_preferences["has_been_welcomed"] = True
-            save_user_data(user_preferences)
-        else:
-            session['chat_history'].append({"sender": "Agent", "message": random.choice(static_knowledge["greetings_info"]) + " What can I do for you today? (Type 'help' for options)"})
-
+    start_chat_history(user_id, user_preferences)
+    chat_history = session['chat_history']
 
     if request.method == 'POST':
-        user_message = request.form['user_input']
-        session['chat_history'].append({"sender": "You", "message": user_message})
+        chat_history = handle_chat_turn(request.form['user_input'], user_id, user_preferences)
 
-        intent_name, confidence = recognize_intent_spacy(user_message)
-        extracted_entities = extract_entities(user_message, intent_name)
+    cursor = chat_history[-1].get("seq", 0) if chat_history else 0
+    with metrics.span("render"):
+        return render_template('index.html', chat_history=chat_history, cursor=cursor)
 
-        agent_response = generate_response(user_message, intent_name, extracted_entities, user_preferences, confidence)
-        
-        session['chat_history'].append({"sender": "Agent", "message": agent_response})
-        
-        # Save user preferences after each interaction (if they might have changed)
-        save_user_data(user_preferences)
+@app.route('/chat/turn', methods=['POST'])
+def chat_turn():
+    """
+    Incremental chat: takes `user_input` and the client's `cursor` (the last seq
+    it has shown) and returns only the entries after it as an HTML fragment.
+    If a new conversation had to be started, "reset" is true and the fragment
+    holds the whole (new) history, which should replace what the page shows.
+    """
+    user_message = request.form.get('user_input', '')
+    try:
+        cursor = int(request.form.get('cursor', 0))
+    except ValueError:
+        return api_error("'cursor' must be an integer")
+
+    user_id = get_user_id()
+    user_preferences = load_user_data(user_id)
+    reset = start_chat_history(user_id, user_preferences)
+    if reset:
+        cursor = 0
+    chat_history = session['chat_history']
+    if user_message.strip():
+        chat_history = handle_chat_turn(user_message, user_id, user_preferences)
+
+    new_entries = chat_history_since(chat_history, cursor)
+    with metrics.span("render"):
+        html = render_template('_chat_messages.html', chat_history=new_entries)
+    return jsonify({
+        "cursor": chat_history[-1].get("seq", 0) if chat_history else cursor,
+        "reset": reset,
+        "ended": 'chat_history' not in session,
+        "html": html,
+    })
+
+def chat_history_since(chat_history, cursor):
+    """Entries with seq > cursor, scanning from the newest end (only a few per turn)."""
+    start = len(chat_history)
+    while start > 0 and chat_history[start - 1].get("seq", 0) > cursor:
+        start -= 1
+    return chat_history[start:]
+
+# Endpoints that must answer even while models are still loading
+ENDPOINTS_WITHOUT_MODELS = {"healthz", "readyz", "prometheus_metrics", "weather_cache_stats", "static"}
+
+@app.before_request
+def start_request_timing():
+    metrics.begin_request()
+
+@app.before_request
+def require_models():
+    """Answers 503 until the models are ready, starting the load if nobody has yet."""
+    if models_ready.is_set() or request.endpoint in ENDPOINTS_WITHOUT_MODELS:
+        return None
+    init_models()
+    if model_load_error:
+        return jsonify({"error": "models failed to load", "detail": model_load_error}), 503
+    return jsonify({"error": "models are still loading, retry shortly"}), 503, {"Retry-After": "2"}
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving."""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: models are loaded and warmed up."""
+    if models_ready.is_set():
+        return jsonify({"status": "ready"})
+    if model_load_error:
+        return jsonify({"status": "failed", "detail": model_load_error}), 503
+    return jsonify({"status": "loading"}), 503
+
+@app.after_request
+def finish_request_timing(response):
+    """Records request-level metrics and, if configured, logs the stage breakdown."""
+    timing = metrics.end_request(request.endpoint or "unknown")
+    if timing is not None and REQUEST_TIMING_LOG:
+        timing_logger.info(json.dumps({
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "status": response.status_code,
+            "total_ms": round(timing["total_seconds"] * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in timing["stages"].items()},
+            "counts": timing["counts"],
+        }))
+    return response
+
+@app.after_request
+def persist_user_state(response):
+    """Flushes changed preferences and hands new visitors their user id cookie."""
+    with metrics.span("preferences.flush"):
+        preference_store.flush()
+    new_user_id = g.get("new_user_id")
+    if new_user_id:
+        response.set_cookie(USER_ID_COOKIE, new_user_id, max_age=60 * 60 * 24 * 365, httponly=True, samesite="Lax")
+    return response
+
+# --- JSON API ---
+# API sessions are identified by a caller-supplied session_id instead of a cookie.
+# Their conversation context lives in the same session backend, under an "api:" prefix.
+
+def load_api_state(session_id):
+    """Returns the stored conversation state for an API session (a new dict if unseen)."""
+    return session_backend.load("api:" + session_id) or {}
+
+def save_api_state(session_id, state):
+    session_backend.save("api:" + session_id, state)
+
+def api_turn(user_message, session_id, state, user_id=None, tokens=None):
+    """
+    Runs one message through NLU and generate_response against an API session's state.
+    Returns the JSON-ready result for that message.
+    """
+    user_id = user_id or session_id
+    user_preferences = load_user_data(user_id)
+    analysis, intent_name, confidence, extracted_entities = analyze_message(user_message, tokens=tokens)
+    agent_response = generate_response(user_message, intent_name, extracted_entities, user_preferences,
+                                       confidence, analysis, state=state)
+    save_user_data(user_preferences, user_id)
+    if intent_name == "exit":
+        state.clear()
+    return {
+        "session_id": session_id,
+        "intent": intent_name,
+        "confidence": round(confidence, 4),
+        "entities": extracted_entities,
+        "sentiment": analysis.sentiment,
+        "response": agent_response,
+    }
+
+def api_error(message, status=400):
+    return jsonify({"error": message}), status
+
+def parse_api_message(item):
+    """Validates one {"session_id", "message"[, "user_id"]} object; returns it or an error string."""
+    if not isinstance(item, dict):
+        return None, "each message must be a JSON object"
+    user_message = item.get("message")
+    session_id = item.get("session_id")
+    if not isinstance(user_message, str) or not user_message.strip():
+        return None, "'message' must be a non-empty string"
+    if not isinstance(session_id, str) or not session_id:
+        return None, "'session_id' must be a non-empty string"
+    user_id = item.get("user_id")
+    if user_id is not None and not isinstance(user_id, str):
+        return None, "'user_id' must be a string"
+    if (user_id or session_id) == LEGACY_USER_ID:
+        return None, f"'{LEGACY_USER_ID}' is reserved and can't be used as a user id"
+    return (user_message, session_id, user_id), None
+
+@app.route('/api/chat', methods=['POST'])
+def api_chat():
+    """
+    Single message: {"session_id": "...", "message": "..."}.
+    Returns intent, confidence, entities, sentiment and the agent's response.
+    """
+    parsed, error = parse_api_message(request.get_json(silent=True))
+    if error:
+        return api_error(error)
+    user_message, session_id, user_id = parsed
+    state = load_api_state(session_id)
+    result = api_turn(user_message, session_id, state, user_id)
+    save_api_state(session_id, state)
+    return jsonify(result)
+
+@app.route('/api/chat/batch', methods=['POST'])
+def api_chat_batch():
+    """
+    Many messages: {"messages": [{"session_id": ..., "message": ...}, ...], "batch_size": 64}.
+    All texts are tokenized together through nlp.tokenizer.pipe; like a single
+    turn, a message only gets the full pipeline if the NLU cache and the entity
+    fast path can't answer it. Messages of the same session are answered in the
+    order given. Results come back in input order.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("messages"), list):
+        return api_error("body must be a JSON object with a 'messages' list")
+    items = payload["messages"]
+    if len(items) > API_BATCH_MAX_MESSAGES:
+        return api_error(f"at most {API_BATCH_MAX_MESSAGES} messages per batch")
+    batch_size = payload.get("batch_size", API_BATCH_SIZE)
+    if not isinstance(batch_size, int) or batch_size < 1:
+        return api_error("'batch_size' must be a positive integer")
+
+    parsed_items = []
+    for index, item in enumerate(items):
+        parsed, error = parse_api_message(item)
+        if error:
+            return api_error(f"messages[{index}]: {error}")
+        parsed_items.append(parsed)
+
+    token_docs = nlp.tokenizer.pipe((user_message for user_message, _, _ in parsed_items), batch_size=batch_size)
+    states = {}
+    results = []
+    for (user_message, session_id, user_id), tokens in zip(parsed_items, token_docs):
+        if session_id not in states:
+            states[session_id] = load_api_state(session_id)
+        results.append(api_turn(user_message, session_id, states[session_id], user_id, tokens))
+    for session_id, state in states.items():
+        save_api_state(session_id, state)
+    return jsonify({"results": results})
+
+metrics.register(metrics.CallbackMetric(
+    "chat_weather_client_events_total", "Weather cache and upstream counters.", "counter", "event",
+    lambda: {key: value for key, value in weather_client.stats().items()
+             if key in ("hits", "misses", "coalesced", "upstream_calls", "upstream_errors", "short_circuited", "deadline_misses", "refreshes")}
+))
+metrics.register(metrics.CallbackMetric(
+    "chat_nlu_cache_events_total", "Shared NLU result cache hits, misses and invalidations.", "counter", "event",
+    lambda: {key: value for key, value in nlu_cache.stats().items() if key != "size"}
+))
+metrics.register(metrics.CallbackMetric(
+    "chat_preference_store_events_total", "Preference store cache hits, database reads/writes and keys written.",
+    "counter", "event", lambda: {key: value for key, value in preference_store.stats().items() if key != "cached_users"}
+))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
-        # Handle exit intent - clear session and redirect to show goodbye
-        if intent_name == "exit":
-            final_goodbye = static_knowledge["goodbye_response"]
-            session['chat_history'].append({"sender": "Agent", "message": final_goodbye})
-            session.clear() # Clear session for a new conversation on refresh/revisit
-            save_user_data(user_preferences) # Ensure user_preferences are saved one last time
-            return render_template('index.html', chat_history=session['chat_history']) # Render with goodbye
+metrics.register(metrics.CallbackMetric(
+    "chat_weather_prefetch_events_total", "Background weather refresh rounds, refreshed cities and failures.",
+    "counter", "event", lambda: {key: value for key, value in weather_prefetcher.stats().items()
+                                 if key in ("rounds", "refreshed", "skipped_fresh", "failed")}
+))
 
-    # Update session context after processing each request
-    session.modified = True 
-    return render_template('index.html', chat_history=session['chat_history'])
+@app.route('/stats/weather-cache')
+def weather_cache_stats():
+    """Weather cache hit/miss/coalesced counters, for sizing the cache."""
+    stats = weather_client.stats()
+    stats["prefetch"] = weather_prefetcher.stats()
+    return jsonify(stats)
 
 # --- Run Flask App ---
 if __name__ == '__main__':
     # When running locally, set debug=True for automatic reloading on code changes
     # and more detailed error messages. Remember to turn off in production.
+    init_models(background=True)
+    start_weather_prefetcher()
+    atexit.register(nlu_cache.save)
     app.run(debug=True) # debug=True is good for development
\ No newline at end of file
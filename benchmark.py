@@ -0,0 +1,219 @@
+"""
+Per-stage latency benchmarks for the chat pipeline.
+
+Times each stage on its own: recognize_intent_spacy, extract_entities,
+get_sentiment, generate_response per intent (including every turn of the
+multi-turn scheduling confirmation flow), and both the full index.html render
+and the /chat/turn fragment render at several history lengths. Weather calls
+go to a local stub server with configurable latency, so results don't depend
+on the network.
+
+    python benchmark.py                                  # print a report
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --compare bench_baseline.json --threshold 0.25
+
+With --compare, the exit status is 1 if any stage's p50 or p95 regressed past
+the threshold (relative) and by more than --min-delta-ms (absolute).
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from stub_weather_server import start_stub_server
+
+STAGE_MESSAGES = [
+    "Hello there!",
+    "What's the weather in London?",
+    "Weather in Paris, Berlin and Rome",
+    "Schedule a meeting for tomorrow at 3 PM",
+    "Thanks, I really appreciate it",
+    "help me",
+    "who are you",
+    "what year is it",
+    "my city is Tokyo",
+    "I'm not sure what to say",
+]
+
+INTENT_MESSAGES = {
+    "greet": "Hello there!",
+    "get_weather": "What's the weather in London?",
+    "get_weather_multi": "Weather in Paris, Berlin and Rome",
+    "thank_you": "Thanks, I really appreciate it",
+    "about_agent": "who are you",
+    "agent_capabilities": "what can you do",
+    "get_current_year": "what year is it",
+    "help": "help",
+    "set_preferred_city": "remember my city",
+    "exit": "bye",
+    "unknown": "I'm not sure what to say",
+}
+
+SCHEDULE_FLOW = [
+    ("1_request", "Schedule a meeting"),
+    ("2_date", "tomorrow"),
+    ("3_time", "3 PM"),
+    ("4_confirm", "yes"),
+]
+
+HISTORY_LENGTHS = [0, 10, 50, 200]
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(fraction * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+class StageRecorder:
+    """Collects timing samples (seconds) and allocation peaks (bytes) per stage name."""
+    def __init__(self):
+        self.samples = {}
+        self.allocations = {}
+
+    def time(self, name, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.samples.setdefault(name, []).append(time.perf_counter() - started)
+        return result
+
+    def allocate(self, name, fn, *args, **kwargs):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn(*args, **kwargs)
+        self.allocations.setdefault(name, []).append(tracemalloc.get_traced_memory()[1] - before)
+        return result
+
+    def report(self):
+        stages = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            allocations = self.allocations.get(name, [])
+            stages[name] = {
+                "n": len(ordered),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 4),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 4),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 4),
+                "alloc_peak_kib": round(sum(allocations) / len(allocations) / 1024, 2) if allocations else None,
+            }
+        return stages
+
+
+def run_scenarios(app, record, iterations):
+    """Runs every benchmark scenario `iterations` times through `record` (StageRecorder.time or .allocate)."""
+    for _ in range(iterations):
+        for message in STAGE_MESSAGES:
+            analysis = app.MessageAnalysis(message)
+            record("nlu.tokenize", lambda: analysis.tokens)
+            intent, _ = record("nlu.recognize_intent_spacy", app.recognize_intent_spacy, message, analysis)
+            record("nlu.parse", lambda: analysis.doc)
+            record("nlu.extract_entities", app.extract_entities, message, intent, analysis)
+            record("nlu.get_sentiment", app.get_sentiment, message)
+            app.nlu_cache.clear()
+            record("nlu.analyze_message (cold)", app.analyze_message, message)
+            record("nlu.analyze_message (cached)", app.analyze_message, message)
+
+        for intent_label, message in INTENT_MESSAGES.items():
+            _, intent, confidence, entities = app.analyze_message(message)
+            if intent_label.startswith("get_weather"):
+                app.weather_client.clear()
+                analysis = app.MessageAnalysis(message)
+                record(f"generate_response[{intent_label}, uncached]", app.generate_response,
+                       message, intent, entities, {}, confidence, analysis, state={})
+            analysis = app.MessageAnalysis(message)
+            record(f"generate_response[{intent_label}]", app.generate_response,
+                   message, intent, entities, {}, confidence, analysis, state={})
+
+        state = {}
+        for step, message in SCHEDULE_FLOW:
+            analysis, intent, confidence, entities = app.analyze_message(message)
+            record(f"generate_response[schedule_flow.{step}]", app.generate_response,
+                   message, intent, entities, {}, confidence, analysis, state=state)
+
+        for length in HISTORY_LENGTHS:
+            history = [{"seq": i + 1, "sender": "You" if i % 2 else "Agent",
+                        "message": f"message number {i} in this conversation"} for i in range(length)]
+            with app.app.test_request_context('/'):
+                record(f"render.index_html[history={length}]", app.render_template, 'index.html',
+                       chat_history=history, cursor=length)
+                record(f"render.chat_turn_fragment[history={length}]", app.render_template, '_chat_messages.html',
+                       chat_history=app.chat_history_since(history, max(0, length - 2)))
+
+
+def compare(current, baseline, threshold, min_delta_ms):
+    """Returns a list of human-readable regressions of `current` against `baseline`."""
+    regressions = []
+    for name, stats in current.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            before, after = base[key], stats[key]
+            if after - before > min_delta_ms and before > 0 and (after - before) / before > threshold:
+                regressions.append(f"{name} {key}: {before:.4f} -> {after:.4f} ms (+{(after - before) / before:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage latency benchmarks for the chat pipeline.")
+    parser.add_argument("--iterations", type=int, default=200, help="timed rounds over every scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed rounds first")
+    parser.add_argument("--alloc-iterations", type=int, default=20, help="rounds traced with tracemalloc (0 to skip)")
+    parser.add_argument("--weather-latency", type=float, default=0.05, help="stub weather server delay in seconds")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against a baseline JSON file and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown per stage")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    stub = start_stub_server(latency=args.weather_latency)
+    import app
+    app.load_models()
+    app.weather_client.base_url = stub.url
+
+    recorder = StageRecorder()
+    run_scenarios(app, lambda name, fn, *a, **kw: fn(*a, **kw), args.warmup)
+    run_scenarios(app, recorder.time, args.iterations)
+    if args.alloc_iterations:
+        tracemalloc.start()
+        run_scenarios(app, recorder.allocate, args.alloc_iterations)
+        tracemalloc.stop()
+    stub.shutdown()
+
+    stages = recorder.report()
+    print(f"{'stage':<58}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'alloc KiB':>11}")
+    for name in stages:
+        stats = stages[name]
+        alloc = "" if stats["alloc_peak_kib"] is None else f"{stats['alloc_peak_kib']:.1f}"
+        print(f"{name:<58}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}{alloc:>11}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({
+                "python": platform.python_version(),
+                "spacy_model": f"{app.nlp.meta.get('name')}-{app.nlp.meta.get('version')}",
+                "iterations": args.iterations,
+                "weather_latency": args.weather_latency,
+                "stages": stages,
+            }, f, indent=4)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["stages"]
+        regressions = compare(stages, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) regressed more than {args.threshold:.0%}:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"\nNo stage regressed more than {args.threshold:.0%} against {args.compare}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
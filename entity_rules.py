@@ -0,0 +1,219 @@
+"""
+Rule-based fast path for the entities the chat flows need: cities (from a
+gazetteer), dates and times (from compiled patterns).
+
+Matching is plain dictionary lookups and a handful of regex searches, so it
+takes microseconds and works on lowercase input ("weather in london",
+"tomorrow at 3pm"). Callers fall back to spaCy's statistical NER for what
+is missing here: no match at all, or names the gazetteer doesn't know
+(CityGazetteer.unmatched()).
+
+Extraction returns the text as the user wrote it. parse_date() and
+parse_time() turn that text (or a NER span) into a datetime.date and an
+"HH:MM" string. Relative dates are resolved only when they are used, so
+extraction results can be cached across days.
+"""
+import calendar
+import datetime
+import hashlib
+import re
+
+# Words as the gazetteer sees them: letters, with inner apostrophes, dots and hyphens kept
+_WORD_RE = re.compile(r"[^\W\d_]+(?:['’.\-][^\W\d_]+)*")
+
+
+# Capitalized names in a place list: after "in", "and", "or", "," or "&" ("in Paris, Berlin and Atlantis")
+_NAME = r"[^\W\d_a-z][^\W\d_]+(?:['’.\-][^\W\d_]+)*"
+_LISTED_NAME_RE = re.compile(r"(?:\b(?:in|and|or)|[,&])\s+(" + _NAME + r"(?:\s+" + _NAME + r")*)")
+
+
+def _words(text):
+    return [match.group().casefold() for match in _WORD_RE.finditer(text)]
+
+
+class CityGazetteer:
+    """
+    Case-insensitive lookup of known city names in free text.
+
+    Names are matched on whole words, longest name first, so "New York" wins
+    over "York". Matches are returned with the canonical spelling from the
+    gazetteer.
+    """
+    def __init__(self, names=()):
+        self._names = {}  # "new york" -> "New York"
+        self.max_words = 0
+        for name in names:
+            key = " ".join(_words(name))
+            if key:
+                self._names.setdefault(key, name)
+                self.max_words = max(self.max_words, key.count(" ") + 1)
+        self.fingerprint = hashlib.sha1("\n".join(sorted(self._names)).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def from_file(cls, path):
+        """Loads one city per line; blank lines and lines starting with '#' are skipped."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                names = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        except FileNotFoundError:
+            print(f"Warning: city gazetteer {path} not found. City extraction will use NER only.")
+            names = []
+        return cls(names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def find(self, text):
+        """Cities mentioned in `text`, in order of appearance, without duplicates."""
+        words = _words(text)
+        found = []
+        index = 0
+        while index < len(words):
+            for length in range(min(self.max_words, len(words) - index), 0, -1):
+                name = self._names.get(" ".join(words[index:index + length]))
+                if name is not None:
+                    if name not in found:
+                        found.append(name)
+                    index += length
+                    break
+            else:
+                index += 1
+        return found
+
+    def unmatched(self, text):
+        """
+        Capitalized names listed like places ("in X", ", X", "and X") that
+        contain no known city, in order of appearance: candidates for NER.
+        """
+        names = []
+        for match in _LISTED_NAME_RE.finditer(text):
+            name = match.group(1)
+            if not self.find(name) and name not in names:
+                names.append(name)
+        return names
+
+
+# --- Dates ---
+
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+_MONTHS["sept"] = 9
+_MONTH_PATTERN = "(?:" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r")\.?"
+_ORDINAL = r"(?:st|nd|rd|th)?"
+
+_DATE_PATTERNS = [
+    ("relative", re.compile(r"\b(?:the\s+)?(day\s+after\s+tomorrow|today|tonight|tomorrow)\b", re.IGNORECASE)),
+    ("weekday", re.compile(r"\b(?:(next|this|coming)\s+)?(" + "|".join(_WEEKDAYS) + r")\b", re.IGNORECASE)),
+    ("iso", re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")),
+    ("month_day", re.compile(r"\b(" + _MONTH_PATTERN + r")\s+(\d{1,2})" + _ORDINAL + r"(?:,?\s+(\d{4}))?\b",
+                             re.IGNORECASE)),
+    ("day_month", re.compile(r"\b(?:the\s+)?(\d{1,2})" + _ORDINAL + r"\s+(?:of\s+)?(" + _MONTH_PATTERN + r")"
+                             r"(?:,?\s+(\d{4}))?\b", re.IGNORECASE)),
+]
+
+
+def _first_match(patterns, text):
+    """(kind, match) for the pattern matching earliest in `text`, or (None, None)."""
+    best_kind, best = None, None
+    for kind, pattern in patterns:
+        match = pattern.search(text)
+        if match is not None and (best is None or match.start() < best.start()):
+            best_kind, best = kind, match
+    return best_kind, best
+
+
+def _month_day(month, day, year, today):
+    """The given day, in the next year if no year was given and it has already passed this year."""
+    month = _MONTHS[month.lower().rstrip(".")]
+    try:
+        if year:
+            return datetime.date(int(year), month, int(day))
+        value = datetime.date(today.year, month, int(day))
+        if value < today:
+            value = datetime.date(today.year + 1, month, int(day))
+        return value
+    except ValueError:
+        return None
+
+
+def _resolve_date(kind, match, today):
+    if kind == "relative":
+        word = " ".join(match.group(1).lower().split())
+        offset = {"today": 0, "tonight": 0, "tomorrow": 1, "day after tomorrow": 2}[word]
+        return today + datetime.timedelta(days=offset)
+    if kind == "weekday":
+        qualifier = (match.group(1) or "").lower()
+        days_ahead = (_WEEKDAYS.index(match.group(2).lower()) - today.weekday()) % 7
+        # "Friday"/"this Friday" may be today; "next Friday" is always a later day
+        if qualifier == "next" and days_ahead == 0:
+            days_ahead = 7
+        return today + datetime.timedelta(days=days_ahead)
+    if kind == "iso":
+        try:
+            return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return None
+    if kind == "month_day":
+        return _month_day(match.group(1), match.group(2), match.group(3), today)
+    return _month_day(match.group(2), match.group(1), match.group(3), today)
+
+
+def find_date(text):
+    """The first date expression in `text` that parse_date() understands, as written, or None."""
+    kind, match = _first_match(_DATE_PATTERNS, text)
+    if match is None or _resolve_date(kind, match, datetime.date.today()) is None:
+        return None
+    return match.group()
+
+
+def parse_date(text, today=None):
+    """The datetime.date that `text` refers to (relative to `today`), or None."""
+    if not text:
+        return None
+    kind, match = _first_match(_DATE_PATTERNS, text)
+    if match is None:
+        return None
+    return _resolve_date(kind, match, today or datetime.date.today())
+
+
+# --- Times ---
+
+_TIME_PATTERNS = [
+    ("meridiem", re.compile(r"\b(\d{1,2})(?:[:.](\d{2}))?\s*([ap])\.?\s?m\b\.?", re.IGNORECASE)),
+    ("clock", re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)\b")),
+    ("named", re.compile(r"\b(noon|midday|midnight)\b", re.IGNORECASE)),
+    ("oclock", re.compile(r"\b(\d{1,2})\s*o['’]?\s?clock\b", re.IGNORECASE)),
+]
+
+
+def _resolve_time(kind, match):
+    if kind == "named":
+        return "00:00" if match.group(1).lower() == "midnight" else "12:00"
+    hour = int(match.group(1))
+    minute = int(match.group(2) or 0) if kind in ("meridiem", "clock") else 0
+    if kind == "meridiem":
+        if not 1 <= hour <= 12 or minute > 59:
+            return None
+        hour = hour % 12 + (12 if match.group(3).lower() == "p" else 0)
+    elif hour > 23:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def find_time(text):
+    """The first time expression in `text` that parse_time() understands, as written, or None."""
+    kind, match = _first_match(_TIME_PATTERNS, text)
+    if match is None or _resolve_time(kind, match) is None:
+        return None
+    return match.group()
+
+
+def parse_time(text):
+    """The time `text` refers to as "HH:MM" (24-hour), or None."""
+    if not text:
+        return None
+    kind, match = _first_match(_TIME_PATTERNS, text)
+    if match is None:
+        return None
+    return _resolve_time(kind, match)
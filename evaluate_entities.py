@@ -0,0 +1,149 @@
+"""
+Accuracy and latency of city/date/time extraction on a labeled fixture set.
+
+Compares three extractors on data/entity_fixtures.jsonl:
+
+    rules     gazetteer + date/time patterns only (entity_rules.py)
+    ner       spaCy's statistical NER only (the previous behaviour)
+    combined  what the app does: rules first, NER only for what they miss
+
+    python evaluate_entities.py
+    python evaluate_entities.py --fixtures my_fixtures.jsonl --json results.json
+
+Each fixture has `text`, `intent` (get_weather or schedule_meeting) and the
+expected `cities`, or `date` (ISO) and `time` (HH:MM), with null meaning "none".
+Dates are resolved relative to --today, which the bundled fixtures assume to
+be 2026-10-19. Cities are compared case-insensitively, in order.
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+
+from benchmark import percentile
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "entity_fixtures.jsonl")
+FIELDS = {"get_weather": ("cities",), "schedule_meeting": ("date", "time")}
+
+
+def load_fixtures(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rules_extract(app, text):
+    return {
+        "cities": app.city_gazetteer.find(text),
+        "date": app.find_date(text),
+        "time": app.find_time(text),
+    }
+
+
+def ner_extract(app, text):
+    spans = [(ent.text, ent.label_) for ent in app.nlp(text).ents]
+    found = {"cities": [], "date": None, "time": None}
+    for span_text, label in spans:
+        if label == "GPE" and span_text not in found["cities"]:
+            found["cities"].append(span_text)
+        if label == "DATE":
+            found["date"] = span_text
+        if label == "TIME":
+            found["time"] = span_text
+    return found
+
+
+def combined_extract_for(app, intent):
+    """The app only resolves the fields an intent needs, so time just those."""
+    def extract(_, text):
+        analysis = app.MessageAnalysis(text)
+        if intent == "get_weather":
+            found = {"cities": analysis.cities}
+        else:
+            date, time_text = analysis.meeting_details
+            found = {"date": date, "time": time_text}
+        found["ner_ran"] = analysis._doc is not None
+        return found
+    return extract
+
+
+def normalize(app, field, value, today):
+    if field == "cities":
+        return [city.casefold() for city in value or []]
+    if field == "date":
+        parsed = app.parse_date(value, today)
+        return parsed.isoformat() if parsed else None
+    return app.parse_time(value)
+
+
+def evaluate(app, fixtures, today, repeat):
+    extractors = {"rules": lambda intent: rules_extract, "ner": lambda intent: ner_extract,
+                  "combined": lambda intent: combined_extract_for(app, intent)}
+    results = {}
+    for name, extractor_for in extractors.items():
+        correct = {field: 0 for fields in FIELDS.values() for field in fields}
+        total = dict.fromkeys(correct, 0)
+        samples, ner_runs, misses = [], 0, []
+        for fixture in fixtures:
+            extract = extractor_for(fixture["intent"])
+            for _ in range(repeat):
+                started = time.perf_counter()
+                found = extract(app, fixture["text"])
+                samples.append(time.perf_counter() - started)
+            ner_runs += found.get("ner_ran", name == "ner")
+            for field in FIELDS[fixture["intent"]]:
+                expected = normalize(app, field, fixture.get(field), today) if field == "cities" else fixture.get(field)
+                actual = normalize(app, field, found.get(field), today)
+                total[field] += 1
+                if actual == expected:
+                    correct[field] += 1
+                else:
+                    misses.append({"text": fixture["text"], "field": field, "expected": expected, "got": actual})
+        ordered = sorted(samples)
+        results[name] = {
+            "accuracy": {field: round(correct[field] / total[field], 4) for field in total if total[field]},
+            "overall_accuracy": round(sum(correct.values()) / sum(total.values()), 4),
+            "p50_us": round(percentile(ordered, 0.50) * 1e6, 1),
+            "p95_us": round(percentile(ordered, 0.95) * 1e6, 1),
+            "ner_run_rate": round(ner_runs / len(fixtures), 4),
+            "misses": misses,
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accuracy and latency of city/date/time extraction.")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="labeled fixtures (JSONL)")
+    parser.add_argument("--today", default="2026-10-19", help="reference date the fixture dates are relative to")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per fixture and extractor")
+    parser.add_argument("--show-misses", action="store_true", help="list every wrong extraction")
+    parser.add_argument("--json", help="write the full results to this JSON file")
+    args = parser.parse_args(argv)
+
+    import app
+    app.load_models()
+    today = datetime.date.fromisoformat(args.today)
+
+    fixtures = load_fixtures(args.fixtures)
+    results = evaluate(app, fixtures, today, args.repeat)
+
+    fields = [field for fields in FIELDS.values() for field in fields]
+    print(f"{len(fixtures)} fixtures, reference date {today}\n")
+    print(f"{'extractor':<10}" + "".join(f"{field:>9}" for field in fields) +
+          f"{'overall':>9}{'p50 us':>10}{'p95 us':>10}{'NER runs':>10}")
+    for name, result in results.items():
+        print(f"{name:<10}" + "".join(f"{result['accuracy'].get(field, 0):>9.1%}" for field in fields) +
+              f"{result['overall_accuracy']:>9.1%}{result['p50_us']:>10.1f}{result['p95_us']:>10.1f}"
+              f"{result['ner_run_rate']:>10.0%}")
+    if args.show_misses:
+        for name, result in results.items():
+            for miss in result["misses"]:
+                print(f"  [{name}] {miss['field']}: {miss['text']!r} expected {miss['expected']!r}, got {miss['got']!r}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"today": args.today, "fixtures": len(fixtures), "results": results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
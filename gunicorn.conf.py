@@ -0,0 +1,50 @@
+"""
+Production serving config:  gunicorn -c gunicorn.conf.py "app:create_app()"
+
+The app is preloaded in the master process, so spaCy and VADER are loaded once
+and shared copy-on-write by every forked worker. Each worker runs several
+threads so a slow OpenWeatherMap call doesn't block other users.
+"""
+import multiprocessing
+import os
+
+# Workers don't share memory, so keep sessions in the SQLite backend unless told otherwise
+os.environ.setdefault("SESSION_BACKEND", "sqlite")
+# ...and each worker has its own metrics, so /metrics adds up per-worker snapshots kept here
+os.environ.setdefault("METRICS_MULTIPROCESS_DIR", "metrics_snapshots")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 4))
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so slow leaks can't accumulate
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 5000))
+max_requests_jitter = 500
+accesslog = "-"
+
+
+def on_starting(server):
+    # Counters start from zero with the server; drop the previous run's snapshots
+    import metrics
+    metrics.clear_snapshots(os.environ["METRICS_MULTIPROCESS_DIR"])
+
+
+def post_fork(server, worker):
+    # Threads don't survive fork(): each worker runs its own weather prefetcher
+    # to keep its own weather cache warm (at its share of the upstream rate),
+    # and its own metrics snapshot writer
+    import app
+    app.start_weather_prefetcher(server.cfg.workers)
+    app.metrics.start_snapshot_writer()
+
+
+def worker_exit(server, worker):
+    # Only workers have served requests; each merges its NLU results into NLU_CACHE_FILE
+    # and folds its final counts into the metrics archive
+    import app
+    app.nlu_cache.save()
+    app.metrics.retire()
@@ -0,0 +1,435 @@
+"""
+Multi-turn load test: many concurrent simulated users holding real
+conversations with the app over HTTP.
+
+Each virtual user keeps its own cookies (chat session and user id) and
+follows dialogue flows. The flows cover the weather clarification loop,
+multi-city weather, schedule -> date -> time -> Yes/No confirmation,
+preference setting and small talk. With --dialogue scripted, every user
+cycles through the flows in a fixed order. With --dialogue random, users
+walk FLOW_GRAPH, a weighted graph of which flow tends to follow which.
+
+    # against a server that is already running
+    python loadtest.py --url http://127.0.0.1:5000 --users 8 --duration 30
+
+    # spawn gunicorn (with a stub weather server) for each worker/thread/user combination
+    python loadtest.py --spawn --workers 1,2,4 --threads 1,4 --users 8,32 --duration 20 --json load.json
+
+Reported per run: throughput, p50/p99 latency per turn type, error rate
+(HTTP errors, timeouts and replies that don't match the flow) and how
+session size grows. Session size is measured as response bytes by
+conversation length, plus the stored session rows when the SQLite session
+database is reachable (--session-db, or always with --spawn).
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmark import percentile
+from stub_weather_server import start_stub_server
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CITIES = ["London", "Paris", "Tokyo", "Berlin", "Madrid", "Rome", "Sydney", "Toronto", "Chicago", "Dublin",
+          "Lisbon", "Vienna", "Prague", "Oslo", "Seoul", "Cairo", "Lima", "Denver", "Boston", "Miami"]
+DATES = ["tomorrow", "next friday", "monday", "December 3rd", "the day after tomorrow"]
+TIMES = ["3pm", "10:30 am", "noon", "16:00", "9 am"]
+
+# Each step is (turn type, message template, text the agent's reply must contain or None).
+FLOWS = {
+    "weather_direct": [
+        ("weather.ask_city", "what's the weather in {city}", "weather in"),
+    ],
+    "weather_clarification": [
+        ("weather.ask", "what's the weather", None),
+        # Not checked: a preferred or recent city answers the first turn without asking
+        ("weather.clarify_city", "{city}", None),
+    ],
+    "weather_multi_city": [
+        ("weather.multi_city", "weather in {city}, {city2} and {city3}", "weather in"),
+    ],
+    "schedule_confirm": [
+        ("schedule.request", "schedule a meeting", None),
+        ("schedule.date", "{date}", None),
+        ("schedule.time", "at {time}", "Does that sound correct"),
+        ("schedule.confirm", "yes", "confirmed"),
+    ],
+    "schedule_cancel": [
+        ("schedule.request_full", "schedule a meeting {date} at {time}", "Does that sound correct"),
+        ("schedule.cancel", "no", "cancelled"),
+    ],
+    "set_preference": [
+        ("preference.ask", "remember my city", None),
+        ("preference.city", "{city}", "{city}"),
+    ],
+    "smalltalk": [
+        ("smalltalk.greet", "hello", None),
+        ("smalltalk.capabilities", "what can you do", None),
+        ("smalltalk.thanks", "thanks, that's great", None),
+    ],
+    "exit": [
+        ("exit", "bye", None),
+    ],
+}
+
+# Which flow follows which, with weights; a user's conversation starts at "start"
+FLOW_GRAPH = {
+    "start": {"weather_direct": 3, "weather_clarification": 2, "schedule_confirm": 2, "smalltalk": 2,
+              "set_preference": 1, "weather_multi_city": 1},
+    "weather_direct": {"weather_direct": 2, "weather_multi_city": 1, "schedule_confirm": 1, "smalltalk": 1, "exit": 1},
+    "weather_clarification": {"weather_direct": 2, "set_preference": 1, "smalltalk": 1, "exit": 1},
+    "weather_multi_city": {"weather_direct": 1, "schedule_confirm": 1, "exit": 1},
+    "schedule_confirm": {"schedule_cancel": 1, "weather_direct": 2, "smalltalk": 1, "exit": 2},
+    "schedule_cancel": {"schedule_confirm": 1, "smalltalk": 1, "exit": 1},
+    "set_preference": {"weather_direct": 2, "smalltalk": 1, "exit": 1},
+    "smalltalk": {"weather_direct": 2, "schedule_confirm": 1, "weather_clarification": 1, "exit": 1},
+    "exit": {"start": 1},
+}
+
+SCRIPTED_ORDER = ["smalltalk", "weather_direct", "weather_clarification", "schedule_confirm", "weather_multi_city",
+                  "set_preference", "schedule_cancel", "exit"]
+
+
+def flow_sequence(mode, rng, offset):
+    """Endless iterator of flow names for one virtual user."""
+    if mode == "scripted":
+        order = SCRIPTED_ORDER[offset % len(SCRIPTED_ORDER):] + SCRIPTED_ORDER[:offset % len(SCRIPTED_ORDER)]
+        yield from itertools.cycle(order)
+    node = "start"
+    while True:
+        choices = FLOW_GRAPH[node]
+        node = rng.choices(list(choices), weights=list(choices.values()))[0]
+        if node == "start":
+            continue
+        yield node
+
+
+def fill(template, values):
+    return template.format(**values) if template else template
+
+
+def last_agent_message(html):
+    """Text of the last agent bubble in a chat HTML page or fragment."""
+    marker = 'message-bubble agent">'
+    if marker not in html:
+        return ""
+    return html.rsplit(marker, 1)[1].split("</div>", 1)[0].strip()
+
+
+class Recorder:
+    """Thread-safe collection of turn results."""
+    def __init__(self):
+        self.turns = []  # (turn type, seconds, error or None, response bytes, history length)
+        self._lock = threading.Lock()
+
+    def add(self, turn_type, seconds, error, size, history_length):
+        with self._lock:
+            self.turns.append((turn_type, seconds, error, size, history_length))
+
+
+class VirtualUser(threading.Thread):
+    """One simulated browser: its own cookie jar, walking dialogue flows until `deadline`."""
+    def __init__(self, index, base_url, recorder, deadline, mode, endpoint, think_time, timeout, seed):
+        super().__init__(name=f"user-{index}", daemon=True)
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.deadline = deadline
+        self.mode = mode
+        self.endpoint = endpoint
+        self.think_time = think_time
+        self.timeout = timeout
+        self.rng = random.Random(seed + index)
+        self.flows = flow_sequence(mode, self.rng, index)
+        self.http = requests.Session()
+        self.cursor = 0
+        self.history_length = 0
+
+    def run(self):
+        self.page_load()
+        while time.monotonic() < self.deadline:
+            flow = next(self.flows)
+            cities = self.rng.sample(CITIES, 3)
+            values = {"city": cities[0], "city2": cities[1], "city3": cities[2],
+                      "date": self.rng.choice(DATES), "time": self.rng.choice(TIMES)}
+            for turn_type, template, expect in FLOWS[flow]:
+                if time.monotonic() >= self.deadline:
+                    return
+                self.turn(turn_type, fill(template, values), fill(expect, values))
+                if self.think_time:
+                    time.sleep(self.rng.uniform(0, 2 * self.think_time))
+
+    def page_load(self):
+        started = time.perf_counter()
+        try:
+            response = self.http.get(self.base_url + "/", timeout=self.timeout)
+            error = None if response.status_code == 200 else f"http_{response.status_code}"
+            size = len(response.content)
+            self.history_length = response.text.count("message-row ")
+        except requests.RequestException as e:
+            error, size = type(e).__name__, 0
+        self.recorder.add("page_load", time.perf_counter() - started, error, size, self.history_length)
+
+    def turn(self, turn_type, message, expect):
+        started = time.perf_counter()
+        error, size = None, 0
+        try:
+            if self.endpoint == "fragment":
+                response = self.http.post(self.base_url + "/chat/turn", timeout=self.timeout,
+                                          data={"user_input": message, "cursor": self.cursor})
+                size = len(response.content)
+                if response.status_code != 200:
+                    error = f"http_{response.status_code}"
+                else:
+                    payload = response.json()
+                    added = payload["html"].count("message-row ")
+                    self.history_length = added if payload["reset"] else self.history_length + added
+                    self.cursor = 0 if payload["ended"] else payload["cursor"]
+                    reply = last_agent_message(payload["html"])
+            else:
+                response = self.http.post(self.base_url + "/", data={"user_input": message}, timeout=self.timeout)
+                size = len(response.content)
+                if response.status_code != 200:
+                    error = f"http_{response.status_code}"
+                else:
+                    self.history_length = response.text.count("message-row ")
+                    reply = last_agent_message(response.text)
+            if error is None and expect and expect.lower() not in reply.lower():
+                error = "unexpected_reply"
+        except (requests.RequestException, ValueError, KeyError) as e:
+            error = type(e).__name__
+        self.recorder.add(turn_type, time.perf_counter() - started, error, size, self.history_length)
+
+
+def session_db_sizes(path):
+    """(sessions, average bytes, max bytes) stored in a SQLite session database, or None."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=5)
+        try:
+            count, average, largest = conn.execute(
+                "SELECT COUNT(*), AVG(LENGTH(data)), MAX(LENGTH(data)) FROM sessions").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return {"sessions": count, "avg_bytes": round(average or 0), "max_bytes": largest or 0}
+
+
+def run_load(base_url, users, duration, mode, endpoint, think_time, timeout, seed, session_db=None, ramp_up=0.0):
+    """Runs `users` virtual users for `duration` seconds and returns the summary dict."""
+    recorder = Recorder()
+    session_samples = []
+    deadline = time.monotonic() + ramp_up + duration
+    threads = [VirtualUser(index, base_url, recorder, deadline, mode, endpoint, think_time, timeout, seed)
+               for index in range(users)]
+    started = time.monotonic()
+    for index, thread in enumerate(threads):
+        thread.start()
+        if ramp_up and users > 1:
+            time.sleep(ramp_up / users)
+    while any(thread.is_alive() for thread in threads):
+        sizes = session_db_sizes(session_db)
+        if sizes is not None:
+            session_samples.append(dict(sizes, t=round(time.monotonic() - started, 1)))
+        for thread in threads:
+            thread.join(timeout=1.0)
+            if time.monotonic() - started > ramp_up + duration + timeout + 5:
+                break
+    elapsed = time.monotonic() - started
+    return summarize(recorder.turns, elapsed, users, session_samples)
+
+
+def summarize(turns, elapsed, users, session_samples):
+    by_type = {}
+    for turn_type, seconds, error, _, _ in turns:
+        stats = by_type.setdefault(turn_type, {"samples": [], "errors": 0})
+        stats["samples"].append(seconds)
+        stats["errors"] += error is not None
+    turn_types = {}
+    for turn_type, stats in sorted(by_type.items()):
+        ordered = sorted(stats["samples"])
+        turn_types[turn_type] = {
+            "n": len(ordered),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+            "error_rate": round(stats["errors"] / len(ordered), 4),
+        }
+
+    errors = {}
+    for _, _, error, _, _ in turns:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    all_samples = sorted(seconds for _, seconds, _, _, _ in turns)
+
+    # Response size by conversation length, in buckets of 10 messages
+    growth = {}
+    for _, _, error, size, history_length in turns:
+        if error is None:
+            bucket = growth.setdefault(history_length // 10 * 10, [])
+            bucket.append(size)
+    return {
+        "users": users,
+        "seconds": round(elapsed, 2),
+        "turns": len(turns),
+        "turns_per_second": round(len(turns) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(all_samples, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(all_samples, 0.99) * 1000, 2),
+        "error_rate": round(sum(errors.values()) / len(turns), 4) if turns else 0.0,
+        "errors": errors,
+        "turn_types": turn_types,
+        "response_bytes_by_history": {f"{bucket}-{bucket + 9}": round(sum(sizes) / len(sizes))
+                                      for bucket, sizes in sorted(growth.items())},
+        "session_store": session_samples,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SpawnedServer:
+    """gunicorn with the repo's config in a scratch directory, pointed at the stub weather server."""
+    def __init__(self, workers, threads, weather_url, extra_env=None, ready_timeout=120):
+        self.workdir = tempfile.mkdtemp(prefix="loadtest-")
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.session_db = os.path.join(self.workdir, "sessions.db")
+        env = dict(os.environ)
+        env.update({
+            "PORT": str(self.port),
+            "WEB_CONCURRENCY": str(workers),
+            "WEB_THREADS": str(threads),
+            "OPENWEATHERMAP_BASE_URL": weather_url,
+            "SESSION_BACKEND": "sqlite",
+            "SESSION_DB_FILE": self.session_db,
+            "PREFERENCE_DB_FILE": os.path.join(self.workdir, "user_data.db"),
+            "SECRET_KEY_FILE": os.path.join(self.workdir, ".secret_key"),
+            "PYTHONPATH": REPO_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        })
+        env.update(extra_env or {})
+        self.log = open(os.path.join(self.workdir, "gunicorn.log"), "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+             "--access-logfile", os.devnull, "app:create_app()"],
+            cwd=self.workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        self.wait_ready(ready_timeout)
+
+    def wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {self.process.returncode}, see {self.log.name}")
+            try:
+                if requests.get(self.url + "/readyz", timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"gunicorn was not ready after {timeout}s, see {self.log.name}")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log.close()
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",") if value.strip()]
+
+
+def print_run(label, result):
+    print(f"\n== {label}: {result['turns']} turns in {result['seconds']}s, {result['turns_per_second']} turns/s, "
+          f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, errors {result['error_rate']:.2%}")
+    if result["errors"]:
+        print("   errors: " + ", ".join(f"{name}={count}" for name, count in sorted(result["errors"].items())))
+    print(f"   {'turn type':<28}{'n':>7}{'p50 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for turn_type, stats in result["turn_types"].items():
+        print(f"   {turn_type:<28}{stats['n']:>7}{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['error_rate']:>9.1%}")
+    print("   response bytes by history length: " +
+          ", ".join(f"{bucket}: {size}" for bucket, size in result["response_bytes_by_history"].items()))
+    if result["session_store"]:
+        first, last = result["session_store"][0], result["session_store"][-1]
+        print(f"   session store: {first['sessions']} -> {last['sessions']} sessions, "
+              f"avg {first['avg_bytes']} -> {last['avg_bytes']} bytes, max {last['max_bytes']} bytes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-turn conversation load test.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running server")
+    target.add_argument("--spawn", action="store_true", help="start gunicorn for every --workers/--threads combination")
+    parser.add_argument("--workers", type=int_list, default=[1], help="gunicorn worker counts to try (with --spawn)")
+    parser.add_argument("--threads", type=int_list, default=[4], help="gunicorn thread counts to try (with --spawn)")
+    parser.add_argument("--users", type=int_list, default=[8], help="concurrent virtual users, e.g. 8,16,32")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per run, after ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=2, help="seconds over which users are started")
+    parser.add_argument("--dialogue", choices=["scripted", "random"], default="random", help="how users pick flows")
+    parser.add_argument("--endpoint", choices=["fragment", "page"], default="fragment",
+                        help="POST /chat/turn (what the page's JavaScript does) or the full-page POST /")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's turns (seconds)")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout (seconds)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for dialogue choices")
+    parser.add_argument("--session-db", help="SQLite session database to sample (with --url)")
+    parser.add_argument("--weather-latency", type=float, default=0.05, help="stub weather server delay (with --spawn)")
+    parser.add_argument("--weather-fail-rate", type=float, default=0.0, help="stub weather 503 rate (with --spawn)")
+    parser.add_argument("--json", help="write every run's results to this JSON file")
+    args = parser.parse_args(argv)
+
+    runs = []
+    if args.url:
+        for users in args.users:
+            result = run_load(args.url, users, args.duration, args.dialogue, args.endpoint, args.think_time,
+                              args.timeout, args.seed, args.session_db, args.ramp_up)
+            runs.append(dict(result, target=args.url))
+            print_run(f"{args.url}, {users} users", result)
+    else:
+        stub = start_stub_server(latency=args.weather_latency, fail_rate=args.weather_fail_rate)
+        try:
+            for workers, threads in itertools.product(args.workers, args.threads):
+                for users in args.users:
+                    # A fresh server per run, so sessions and caches start cold every time
+                    server = SpawnedServer(workers, threads, stub.url)
+                    try:
+                        result = run_load(server.url, users, args.duration, args.dialogue, args.endpoint,
+                                          args.think_time, args.timeout, args.seed, server.session_db, args.ramp_up)
+                    finally:
+                        server.stop()
+                    runs.append(dict(result, workers=workers, threads=threads))
+                    print_run(f"{workers} worker(s) x {threads} thread(s), {users} users", result)
+        finally:
+            stub.shutdown()
+
+        print(f"\n{'workers':>8}{'threads':>8}{'users':>7}{'turns/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>9}")
+        for run in runs:
+            print(f"{run['workers']:>8}{run['threads']:>8}{run['users']:>7}{run['turns_per_second']:>10.1f}"
+                  f"{run['p50_ms']:>10.1f}{run['p99_ms']:>10.1f}{run['error_rate']:>9.1%}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"dialogue": args.dialogue, "endpoint": args.endpoint, "duration": args.duration,
+                       "runs": runs}, f, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
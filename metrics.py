@@ -0,0 +1,374 @@
+"""
+Lightweight in-process instrumentation with Prometheus text output.
+
+    with metrics.span("nlu.parse"):
+        ...
+    metrics.count("spacy_pipeline_runs")
+
+Spans feed the `chat_stage_seconds` histogram, and counts feed
+`chat_events_total`. Between begin_request() and end_request() they are also
+collected per request, so one slow turn can be logged with its breakdown.
+When disabled, span() returns a shared no-op context manager and count() does
+nothing, so the hooks can stay on the hot path.
+
+Every process keeps its own metrics. With `multiprocess_dir` set (gunicorn
+workers), each process also writes a JSON snapshot of its metrics to that
+directory every few seconds, and render() adds up the snapshots of all
+processes, so a scrape sees the whole server whichever worker answers it.
+Processes that exit fold their final counts into an archive file there, so
+totals never go backwards when a worker is recycled.
+"""
+import glob
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshot reads and archiving are not serialized
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16)
+
+enabled = True
+multiprocess_dir = None
+SNAPSHOT_INTERVAL = 5.0
+_ARCHIVE_FILE = "archived.json"
+_local = threading.local()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _render_family(family):
+    """Prometheus text lines for a family from collect()."""
+    name = family["name"]
+    lines = [f"# HELP {name} {family['help']}", f"# TYPE {name} {family['type']}"]
+    for key, value in sorted(family["series"].items()):
+        if family["type"] != "histogram":
+            lines.append(f"{name}{_format_labels(key)} {value}")
+            continue
+        for bound, bucket_count in zip(family["buckets"], value):
+            lines.append(f"{name}_bucket{_format_labels(key + (('le', repr(float(bound))),))} {bucket_count}")
+        lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {value[-2]}")
+        lines.append(f"{name}_count{_format_labels(key)} {value[-2]}")
+        lines.append(f"{name}_sum{_format_labels(key)} {value[-1]}")
+    return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of (label, value) pairs."""
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def collect(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        return {"name": self.name, "help": self.help_text, "type": "histogram",
+                "buckets": list(self.buckets), "series": series}
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of (label, value) pairs."""
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            series = dict(self._series)
+        return {"name": self.name, "help": self.help_text, "type": "counter", "series": series}
+
+
+class CallbackMetric:
+    """Metric whose values are read from `callback()` ({label_value: number}) at scrape time."""
+    def __init__(self, name, help_text, metric_type, label, callback):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.label = label
+        self.callback = callback
+
+    def collect(self):
+        series = {((self.label, str(label_value)),): value for label_value, value in self.callback().items()}
+        return {"name": self.name, "help": self.help_text, "type": self.metric_type, "series": series}
+
+
+stage_seconds = Histogram("chat_stage_seconds", "Time spent in each chat pipeline stage.")
+request_seconds = Histogram("chat_request_seconds", "End-to-end request latency by endpoint.")
+spacy_runs_per_request = Histogram("chat_spacy_invocations_per_request",
+                                   "spaCy pipeline runs per request.", buckets=COUNT_BUCKETS)
+events_total = Counter("chat_events_total", "Counted events (spaCy runs, VADER calls, ...).")
+_registry = [stage_seconds, request_seconds, spacy_runs_per_request, events_total]
+
+
+def register(metric):
+    """Adds a metric (e.g. a CallbackMetric) to the /metrics output."""
+    _registry.append(metric)
+    return metric
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    families = _collect()
+    if multiprocess_dir:
+        write_snapshot(families)
+        families = _aggregate()
+    lines = []
+    for family in families:
+        lines.extend(_render_family(family))
+    return "\n".join(lines) + "\n"
+
+
+# --- Aggregation across processes (see multiprocess_dir) ---
+
+_writer_pid = None
+_writer_thread = None
+_writer_stop = threading.Event()
+_retired = False
+
+
+def _collect():
+    """This process's families; gauges get a `pid` label since they can't be added up."""
+    families = [metric.collect() for metric in _registry]
+    if multiprocess_dir:
+        pid = str(os.getpid())
+        for family in families:
+            if family["type"] == "gauge":
+                family["series"] = {key + (("pid", pid),): value for key, value in family["series"].items()}
+    return families
+
+
+def _merge(merged, families):
+    """Adds `families` into `merged` ({name: family}), summing values (bucket by bucket for histograms)."""
+    for family in families:
+        target = merged.setdefault(family["name"], dict(family, series={}))
+        for key, value in family["series"].items():
+            current = target["series"].get(key)
+            if current is None:
+                target["series"][key] = value
+            elif family["type"] == "histogram":
+                target["series"][key] = [a + b for a, b in zip(current, value)]
+            else:
+                target["series"][key] = current + value
+    return merged
+
+
+def _snapshot_path(pid=None):
+    return os.path.join(multiprocess_dir, f"{pid or os.getpid()}.json")
+
+
+def _read_families(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            families = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read metrics snapshot {path}: {e}")
+        return []
+    for family in families:
+        family["series"] = {tuple(tuple(pair) for pair in key): value for key, value in family["series"]}
+    return families
+
+
+def _write_families(path, families):
+    data = [dict(family, series=[[key, value] for key, value in family["series"].items()]) for family in families]
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class _DirLock:
+    """flock on the snapshot directory: shared while reading, exclusive while archiving."""
+    def __init__(self, exclusive=False):
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        self.file = open(os.path.join(multiprocess_dir, ".lock"), 'w')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+        return False
+
+
+def _aggregate():
+    """Sum of every process's latest snapshot plus the archive."""
+    merged = {}
+    with _DirLock():
+        for path in sorted(glob.glob(os.path.join(multiprocess_dir, "*.json"))):
+            _merge(merged, _read_families(path))
+    return list(merged.values())
+
+
+def _archive(path):
+    """Folds the (counter and histogram) families in `path` into the archive and removes it. Needs the exclusive lock."""
+    families = [family for family in _read_families(path) if family["type"] != "gauge"]
+    if families:
+        archive_path = os.path.join(multiprocess_dir, _ARCHIVE_FILE)
+        _write_families(archive_path, list(_merge(_merge({}, _read_families(archive_path)), families).values()))
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_snapshot(families=None):
+    """Writes this process's metrics to multiprocess_dir (atomically)."""
+    if not multiprocess_dir or _retired:
+        return
+    _write_families(_snapshot_path(), families if families is not None else _collect())
+
+
+def start_snapshot_writer(interval=SNAPSHOT_INTERVAL):
+    """
+    Starts a thread writing this process's snapshot every `interval` seconds
+    (once per process; call it in each forked worker). A snapshot left by an
+    earlier process with the same pid (killed before it could retire) is
+    archived first.
+    """
+    global _writer_pid, _writer_thread, _writer_stop, _retired
+    if not multiprocess_dir or _writer_pid == os.getpid():
+        return
+    os.makedirs(multiprocess_dir, exist_ok=True)
+    with _DirLock(exclusive=True):
+        _archive(_snapshot_path())
+    _writer_pid, _writer_stop, _retired = os.getpid(), threading.Event(), False
+
+    def run(stop):
+        while not stop.wait(interval):
+            try:
+                write_snapshot()
+            except OSError as e:
+                print(f"Warning: could not write metrics snapshot: {e}")
+
+    _writer_thread = threading.Thread(target=run, args=(_writer_stop,), name="metrics-snapshot", daemon=True)
+    _writer_thread.start()
+
+
+def retire():
+    """
+    Folds this process's final counts into the archive and stops writing
+    snapshots. Call it when a worker exits (gunicorn's worker_exit hook).
+    """
+    global _retired
+    if not multiprocess_dir or _retired:
+        return
+    _writer_stop.set()
+    if _writer_thread is not None and _writer_pid == os.getpid():
+        _writer_thread.join(5.0)
+    write_snapshot()
+    _retired = True
+    with _DirLock(exclusive=True):
+        _archive(_snapshot_path())
+
+
+def clear_snapshots(directory):
+    """Removes every snapshot and the archive, so counts start from zero (on server start)."""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        stage_seconds.observe(elapsed, stage=self.stage)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed
+        return False
+
+
+def span(stage):
+    """Context manager timing one stage."""
+    if not enabled:
+        return _NOOP_SPAN
+    return _Span(stage)
+
+
+def count(event, amount=1):
+    """Counts an event globally and for the current request."""
+    if not enabled:
+        return
+    events_total.inc(amount, event=event)
+    counts = getattr(_local, "counts", None)
+    if counts is not None:
+        counts[event] = counts.get(event, 0) + amount
+
+
+def begin_request():
+    """Starts collecting per-request timings and counts on this thread."""
+    if not enabled:
+        return
+    _local.started = time.perf_counter()
+    _local.timings = {}
+    _local.counts = {}
+
+
+def end_request(endpoint):
+    """
+    Stops collecting for this thread, records request-level metrics and returns
+    {"total_seconds", "stages", "counts"} (None when disabled or not started).
+    """
+    started = getattr(_local, "started", None)
+    if not enabled or started is None:
+        return None
+    total = time.perf_counter() - started
+    timings, counts = _local.timings, _local.counts
+    _local.started = _local.timings = _local.counts = None
+    request_seconds.observe(total, endpoint=endpoint)
+    spacy_runs_per_request.observe(counts.get("spacy_pipeline_runs", 0), endpoint=endpoint)
+    return {"total_seconds": total, "stages": timings, "counts": counts}
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are not serialized between processes
+    fcntl = None
+
+
+def normalize_message(text):
+    """Cache key for a message: surrounding and repeated whitespace removed, case kept (NER is case-sensitive)."""
+    return " ".join(text.split())
+
+
+class NLUCache:
+    """
+    Bounded LRU of NLU results shared by all sessions, keyed on normalize_message().
+
+    Entries are plain dicts ({"intent", "confidence", "entities", "entity_spans",
+    "sentiment"}). The last two may start as None and be filled in later by
+    whoever computes them. Every entry belongs to one `fingerprint` (keyword
+    table + model version); set_fingerprint() with a new value drops them all.
+    Only messages up to `max_text_length` characters are cached. With `path`,
+    entries can be saved to and restored from a JSON file across restarts;
+    several processes saving to the same file merge their entries.
+    """
+    def __init__(self, max_entries=5000, max_text_length=64, path=None):
+        self.max_entries = max_entries
+        self.max_text_length = max_text_length
+        self.path = path
+        self.fingerprint = None
+        self._entries = OrderedDict()
+        self._modified = False  # put() since the last load/save; nothing to save otherwise
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def cacheable(self, key):
+        return self.max_entries > 0 and 0 < len(key) <= self.max_text_length
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._modified = True
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_fingerprint(self, fingerprint):
+        """Switches to a new keyword table/model version, discarding entries from the old one."""
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                if self._entries:
+                    self._stats["invalidations"] += 1
+                self._entries.clear()
+                self.fingerprint = fingerprint
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self):
+        """Restores entries saved under the current fingerprint; stale or unreadable files are ignored."""
+        if not self.path:
+            return 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read NLU cache {self.path}: {e}")
+            return 0
+        if saved.get("fingerprint") != self.fingerprint:
+            return 0
+        with self._lock:
+            for key, entry in saved.get("entries", [])[-self.max_entries:]:
+                self._entries[key] = entry
+        return len(self._entries)
+
+    def save(self):
+        """
+        Merges the entries into `path` and writes it atomically (oldest first).
+        Entries already in the file are kept, with this process's entries taking
+        precedence as the most recent. Does nothing if no entry was added since
+        the last load or save, so processes that never served a request (like
+        a preforking master) can't overwrite what the workers saved.
+        """
+        if not self.path or self.fingerprint is None or not self._modified:
+            return
+        with self._lock:
+            fingerprint = self.fingerprint
+            ours = list(self._entries.items())
+            self._modified = False
+        with open(f"{self.path}.lock", 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            merged = OrderedDict()
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get("fingerprint") == fingerprint:
+                    merged.update((key, entry) for key, entry in saved.get("entries", []))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"Warning: could not read NLU cache {self.path}, overwriting it: {e}")
+            for key, entry in ours:
+                merged.pop(key, None)
+                merged[key] = entry
+            snapshot = {"fingerprint": fingerprint, "entries": list(merged.items())[-self.max_entries:]}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        return stats
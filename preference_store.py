@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from sqlite_wal import open_wal_connection
+
+# User id the old single-user user_data.json is migrated under, until its owner claims it
+LEGACY_USER_ID = "default"
+
+
+class PreferenceStore:
+    """
+    Per-user preference store backed by SQLite (WAL mode).
+
+    Each preference is one (user_id, key) row holding a JSON value, so saving
+    a user touches only the keys that changed. Reads and writes go through a
+    bounded in-memory write-back cache: save() only records which keys are
+    dirty, and flush() writes them in a single transaction.
+
+    Several worker processes may share the database, each with its own cache.
+    Every flush bumps the user's row in `user_versions`, and a cache hit is only
+    served if that version still matches the cached copy (one indexed lookup);
+    otherwise the user is read again.
+    """
+    def __init__(self, db_path, legacy_json_path=None, max_cached_users=10000):
+        self.db_path = db_path
+        self.max_cached_users = max_cached_users
+        self._cache = OrderedDict()  # user_id -> prefs as last loaded/saved
+        self._dirty = {}             # user_id -> set of changed keys
+        self._versions = {}          # user_id -> user_versions.version of the cached copy
+        self._stats = {"cache_hits": 0, "db_reads": 0, "db_writes": 0, "keys_written": 0, "stale_reloads": 0}
+        self._lock = threading.RLock()
+        self._conn = None
+        self._conn_pid = None
+        self._init_schema()
+        if legacy_json_path:
+            self.migrate_from_json(legacy_json_path)
+
+    def _connection(self):
+        """One connection per process; reopened after a fork."""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = open_wal_connection(self.db_path)
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _init_schema(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS preferences ("
+                " user_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, key)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_versions ("
+                " user_id TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _stored_version(self, user_id):
+        """The user's version in the database (0 if they were never written)."""
+        row = self._connection().execute(
+            "SELECT version FROM user_versions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def migrate_from_json(self, json_path):
+        """
+        One-shot import of the legacy user_data.json under LEGACY_USER_ID.
+        Recorded in the meta table so it never runs twice; the file is left in place.
+        The rows stay unused until the old file's owner is named with claim_legacy().
+        """
+        with self._lock:
+            conn = self._connection()
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_migrated'").fetchone():
+                return False
+            try:
+                with open(json_path, 'r') as f:
+                    legacy = json.load(f)
+            except FileNotFoundError:
+                legacy = {}
+            except json.JSONDecodeError:
+                print(f"Warning: {json_path} is corrupted or empty. Skipping migration.")
+                legacy = {}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO preferences (user_id, key, value) VALUES (?, ?, ?)",
+                    [(LEGACY_USER_ID, key, json.dumps(value)) for key, value in legacy.items()]
+                )
+                conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_json_migrated', ?)", (json_path,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if legacy:
+                print(f"Migrated {len(legacy)} preference(s) from {json_path} to {self.db_path}.")
+            return True
+
+    def load(self, user_id):
+        """Returns a copy of the user's preferences (empty dict for new users)."""
+        with self._lock:
+            prefs = self._cache.get(user_id)
+            if (prefs is not None and user_id not in self._dirty
+                    and self._stored_version(user_id) != self._versions.get(user_id)):
+                # Another process saved this user since it was cached
+                self._forget(user_id)
+                self._stats["stale_reloads"] += 1
+                prefs = None
+            if prefs is None:
+                # Version first: if a write lands in between, the next load just reads again
+                version = self._stored_version(user_id)
+                rows = self._connection().execute(
+                    "SELECT key, value FROM preferences WHERE user_id = ?", (user_id,)
+                ).fetchall()
+                prefs = {key: json.loads(value) for key, value in rows}
+                self._remember(user_id, prefs, version)
+                self._stats["db_reads"] += 1
+            else:
+                self._cache.move_to_end(user_id)
+                self._stats["cache_hits"] += 1
+            return dict(prefs)
+
+    def claim_legacy(self, user_id):
+        """
+        Hands the migrated legacy preferences to `user_id`, the owner of the old
+        single-user file; keys the user already has are kept. Returns the number
+        of keys moved (0 once they have been claimed).
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                moved = conn.execute(
+                    "INSERT OR IGNORE INTO preferences (user_id, key, value) "
+                    "SELECT ?, key, value FROM preferences WHERE user_id = ?", (user_id, LEGACY_USER_ID)
+                ).rowcount
+                claimed = conn.execute("DELETE FROM preferences WHERE user_id = ?", (LEGACY_USER_ID,)).rowcount
+                if claimed:
+                    conn.execute(
+                        "INSERT INTO user_versions (user_id, version) VALUES (?, 1) "
+                        "ON CONFLICT (user_id) DO UPDATE SET version = version + 1", (user_id,)
+                    )
+                    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_claimed_by', ?)", (user_id,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if user_id not in self._dirty:
+                self._forget(user_id)
+            if claimed:
+                print(f"Migrated legacy preferences assigned to user {user_id}.")
+            return moved
+
+    def save(self, user_id, prefs):
+        """Records the keys that differ from the cached copy; nothing is written until flush()."""
+        with self._lock:
+            current = self._cache.get(user_id)
+            if current is None:
+                self.load(user_id)
+                current = self._cache[user_id]
+            changed = {key for key in prefs.keys() | current.keys()
+                       if key not in prefs or key not in current or prefs[key] != current[key]}
+            if changed:
+                self._dirty.setdefault(user_id, set()).update(changed)
+                self._cache[user_id] = dict(prefs)
+            self._cache.move_to_end(user_id)
+
+    def flush(self):
+        """
+        Writes every dirty key in one transaction and bumps each written user's
+        version. Returns the number of keys written.
+        """
+        with self._lock:
+            if not self._dirty:
+                return 0
+            upserts, deletes = [], []
+            for user_id, keys in self._dirty.items():
+                prefs = self._cache.get(user_id, {})
+                for key in keys:
+                    if key in prefs:
+                        upserts.append((user_id, key, json.dumps(prefs[key])))
+                    else:
+                        deletes.append((user_id, key))
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            new_versions, stale = {}, []
+            try:
+                for user_id in self._dirty:
+                    stored = self._stored_version(user_id)
+                    conn.execute(
+                        "INSERT INTO user_versions (user_id, version) VALUES (?, ?) "
+                        "ON CONFLICT (user_id) DO UPDATE SET version = excluded.version",
+                        (user_id, stored + 1)
+                    )
+                    if stored == self._versions.get(user_id):
+                        new_versions[user_id] = stored + 1
+                    else:
+                        # Someone else wrote this user after we cached it; our copy
+                        # lacks their keys, so drop it once this write is committed
+                        stale.append(user_id)
+                if upserts:
+                    conn.executemany(
+                        "INSERT INTO preferences (user_id, key, value) VALUES (?, ?, ?) "
+                        "ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value",
+                        upserts
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM preferences WHERE user_id = ? AND key = ?", deletes)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._dirty.clear()
+            self._versions.update(new_versions)
+            for user_id in stale:
+                self._forget(user_id)
+            self._evict()
+            self._stats["db_writes"] += 1
+            self._stats["keys_written"] += len(upserts) + len(deletes)
+            return len(upserts) + len(deletes)
+
+    def values_for(self, key):
+        """Distinct values stored under `key` across all users, including changes not yet flushed."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT DISTINCT value FROM preferences WHERE key = ?", (key,)
+            ).fetchall()
+            values = {json.loads(value) for value, in rows}
+            for user_id, keys in self._dirty.items():
+                if key in keys and key in self._cache.get(user_id, {}):
+                    values.add(self._cache[user_id][key])
+        return values
+
+    def stats(self):
+        """Snapshot of cache hits, database reads/writes and keys written."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_users"] = len(self._cache)
+        return stats
+
+    def _remember(self, user_id, prefs, version):
+        self._cache[user_id] = prefs
+        self._versions[user_id] = version
+        self._cache.move_to_end(user_id)
+        self._evict()
+
+    def _forget(self, user_id):
+        self._cache.pop(user_id, None)
+        self._versions.pop(user_id, None)
+
+    def _evict(self):
+        """Drops least recently used clean users once the cache is over its bound."""
+        excess = len(self._cache) - self.max_cached_users
+        if excess <= 0:
+            return
+        for user_id in list(self._cache):
+            if excess <= 0:
+                break
+            if user_id not in self._dirty:
+                self._forget(user_id)
+                excess -= 1
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
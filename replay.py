@@ -0,0 +1,180 @@
+"""
+Offline transcript replay: re-scores logged conversations with the current
+intent_keywords and spaCy model, without going through the web route.
+
+    python replay.py transcripts.jsonl -o scored.jsonl --summary summary.json
+    python replay.py transcripts.csv --n-process 4 --batch-size 256 --respond
+
+Input is JSONL (one object per line) or CSV with a header row; the text column
+is `message` and the optional conversation column is `session_id` (both
+configurable). Messages are streamed through nlp.pipe, so memory use does not
+depend on the input size. With --respond, generate_response is run too, with
+per-session context and an offline weather client that never calls the network.
+Records that can't be read (malformed JSON, a line that isn't an object) are
+skipped with a warning and counted under "skipped" in the summary.
+"""
+import argparse
+import atexit
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, OrderedDict
+
+# app.py opens the preference database and secret key at import and migrates the
+# legacy user_data.json; a replay serves nobody, so keep all of that in a scratch directory
+_scratch_dir = tempfile.mkdtemp(prefix="replay-")
+atexit.register(shutil.rmtree, _scratch_dir, ignore_errors=True)
+os.environ["PREFERENCE_DB_FILE"] = os.path.join(_scratch_dir, "user_data.db")
+os.environ["SECRET_KEY_FILE"] = os.path.join(_scratch_dir, ".secret_key")
+os.environ["USER_DATA_FILE"] = ""
+os.environ["SESSION_BACKEND"] = "memory"
+os.environ["WEATHER_PREFETCH_ENABLED"] = "0"
+os.environ.pop("METRICS_MULTIPROCESS_DIR", None)
+
+import app
+
+# Conversation states kept for --respond; older sessions are dropped past this
+MAX_TRACKED_SESSIONS = 10000
+
+
+class OfflineWeatherClient:
+    """Stands in for WeatherClient during replay: answers instantly with a fixed reading."""
+    def get_weather(self, city):
+        return {"city": city, "temperature": "20°C", "conditions": "clear sky"}
+
+    def get_weather_many(self, cities, deadline):
+        return [self.get_weather(city) for city in cities], []
+
+
+def _jsonl_rows(f, skipped):
+    """(line_number, object) for each non-blank line; unreadable lines are skipped and counted."""
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Warning: line {line_number}: invalid JSON ({e}), skipped.", file=sys.stderr)
+            skipped["invalid_json"] += 1
+            continue
+        if not isinstance(row, dict):
+            print(f"Warning: line {line_number}: not a JSON object, skipped.", file=sys.stderr)
+            skipped["not_an_object"] += 1
+            continue
+        yield line_number, row
+
+
+def _csv_rows(f):
+    rows = csv.DictReader(f)
+    for row in rows:
+        # line_num is the file line the record ended on (records may span lines)
+        yield rows.line_num, row
+
+
+def read_records(path, text_field, session_field, skipped=None):
+    """
+    Yields (line_number, session_id, message) from a JSONL or CSV file, one at a time.
+    Records that can't be read are counted by reason in `skipped` (a Counter).
+    """
+    skipped = Counter() if skipped is None else skipped
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        rows = _csv_rows(f) if path.lower().endswith(".csv") else _jsonl_rows(f, skipped)
+        for line_number, row in rows:
+            message = row.get(text_field)
+            if not isinstance(message, str) or not message.strip():
+                continue
+            yield line_number, str(row.get(session_field) or ""), message
+
+
+def replay(records, out, n_process=1, batch_size=256, respond=False):
+    """
+    Scores every record and writes one JSON line per message to `out`.
+    Returns the summary dict.
+    """
+    intent_counts = Counter()
+    entity_counts = Counter()
+    states = OrderedDict()  # session_id -> {"conversation_context": ..., "user_prefs": ...}
+    processed = 0
+    started = time.perf_counter()
+
+    # nlp.pipe only sees the text; the line number and session ride alongside as context
+    stream = ((message, (line_number, session_id)) for line_number, session_id, message in records)
+    for doc, (line_number, session_id) in app.nlp.pipe(stream, as_tuples=True, n_process=n_process, batch_size=batch_size):
+        message = doc.text
+        analysis, intent_name, confidence, extracted_entities = app.analyze_message(message, doc)
+        result = {
+            "line": line_number,
+            "session_id": session_id,
+            "message": message,
+            "intent": intent_name,
+            "confidence": round(confidence, 4),
+            "entities": extracted_entities,
+            "sentiment": analysis.sentiment,
+        }
+        if respond:
+            state = states.pop(session_id, None) or {"user_prefs": {}}
+            states[session_id] = state
+            if len(states) > MAX_TRACKED_SESSIONS:
+                states.popitem(last=False)
+            result["response"] = app.generate_response(message, intent_name, extracted_entities, state["user_prefs"],
+                                                       confidence, analysis, state=state)
+            if intent_name == "exit":
+                states.pop(session_id, None)
+
+        intent_counts[intent_name] += 1
+        entity_counts.update(key for key in extracted_entities if key != "cities")
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        processed += 1
+
+    elapsed = time.perf_counter() - started
+    return {
+        "messages": processed,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(processed / elapsed, 1) if elapsed > 0 else 0.0,
+        "intents": dict(intent_counts.most_common()),
+        "entities": dict(entity_counts.most_common()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score logged conversations with the current NLU pipeline.")
+    parser.add_argument("input", help="transcript file (.jsonl or .csv)")
+    parser.add_argument("-o", "--output", help="per-message results as JSONL (default: stdout)")
+    parser.add_argument("--summary", help="write the intent/entity distribution summary here as JSON")
+    parser.add_argument("--text-field", default="message", help="column/key holding the message text")
+    parser.add_argument("--session-field", default="session_id", help="column/key holding the conversation id")
+    parser.add_argument("--n-process", type=int, default=1, help="spaCy worker processes for nlp.pipe")
+    parser.add_argument("--batch-size", type=int, default=256, help="nlp.pipe batch size")
+    parser.add_argument("--respond", action="store_true", help="also run generate_response (weather is stubbed)")
+    args = parser.parse_args(argv)
+
+    app.load_models()
+    if args.respond:
+        app.weather_client = OfflineWeatherClient()
+
+    skipped = Counter()
+    records = read_records(args.input, args.text_field, args.session_field, skipped)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        summary = replay(records, out, args.n_process, args.batch_size, respond=args.respond)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    summary["skipped"] = dict(skipped)
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=4)
+    print(f"Replayed {summary['messages']} messages in {summary['seconds']}s "
+          f"({summary['messages_per_second']} messages/sec)", file=sys.stderr)
+    if skipped:
+        print(f"Skipped {sum(skipped.values())} unreadable record(s): {dict(skipped)}", file=sys.stderr)
+    print(json.dumps({"intents": summary["intents"], "entities": summary["entities"]}, indent=4), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
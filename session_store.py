@@ -0,0 +1,147 @@
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from sqlite_wal import open_wal_connection
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives on the server; the cookie only carries `sid`."""
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemorySessionBackend:
+    """
+    In-process session storage with LRU eviction once `max_sessions` is reached.
+    Session dicts are kept as live objects, so saving costs the same no matter
+    how much a session holds. Only shared by threads of one process.
+    """
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            data = self._sessions.get(sid)
+            if data is not None:
+                self._sessions.move_to_end(sid)
+            return data
+
+    def save(self, sid, data):
+        with self._lock:
+            self._sessions[sid] = data
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionBackend:
+    """
+    Session storage in a SQLite file (WAL mode), shared by every worker process
+    on the host. Data is stored as JSON; sessions idle for longer than
+    `max_idle` seconds are purged now and then.
+    """
+    def __init__(self, db_path, max_idle=7 * 24 * 3600):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+        with self._lock:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connection(self):
+        """One connection per process; reopened after a fork."""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = open_wal_connection(self.db_path)
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def load(self, sid):
+        with self._lock:
+            row = self._connection().execute("SELECT data FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO sessions (sid, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (sid) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (sid, json.dumps(data, separators=(",", ":")), time.time())
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.max_idle,))
+
+    def delete(self, sid):
+        with self._lock:
+            self._connection().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface that keeps session data in `backend` and only a random id in the cookie."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.backend.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if not session.new:
+                self.backend.delete(session.sid)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+
+        if session.modified or session.new:
+            # CallbackDict is a dict subclass; store a plain dict in the backend
+            self.backend.save(session.sid, dict(session))
+
+        if session.new or session.permanent:
+            response.set_cookie(
+                cookie_name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
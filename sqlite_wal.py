@@ -0,0 +1,15 @@
+import sqlite3
+
+
+def open_wal_connection(db_path):
+    """
+    Opens a SQLite connection set up for several worker processes sharing one
+    file: WAL journal, synchronous=NORMAL, a 5 s busy timeout and autocommit
+    (callers issue BEGIN/COMMIT themselves). The connection may be used from
+    any thread, so callers serialize access with their own lock.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
@@ -0,0 +1,114 @@
+"""
+Local stand-in for the OpenWeatherMap current-weather endpoint.
+
+Answers GET /data/2.5/weather?q=<city> with the same JSON shape the real API
+uses, after an optional artificial delay. Useful for exercising the weather
+cache, circuit breaker and multi-city fan-out without network access.
+
+Run standalone:
+    python stub_weather_server.py --port 8081 --latency 0.2
+then point the app at it:
+    OPENWEATHERMAP_BASE_URL=http://127.0.0.1:8081/data/2.5/weather python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+UNKNOWN_CITIES = {"atlantis", "nowhere", "gotham"}
+CONDITIONS = ["clear sky", "few clouds", "scattered clouds", "light rain", "overcast clouds", "mist"]
+
+
+class StubWeatherServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with knobs for latency and failure injection.
+    `latency` and `jitter` are in seconds; `fail_rate` is the share of
+    requests answered with HTTP 503. All of them can be changed while running.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, fail_rate=0.0):
+        super().__init__(address, StubWeatherHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/data/2.5/weather"
+
+    def count_request(self):
+        with self._count_lock:
+            self.request_count += 1
+
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        city = parse_qs(urlparse(self.path).query).get("q", [""])[0].strip()
+        if random.random() < server.fail_rate:
+            self._send(503, {"cod": 503, "message": "stub upstream failure"})
+        elif not city or city.casefold() in UNKNOWN_CITIES:
+            self._send(404, {"cod": "404", "message": "city not found"})
+        else:
+            # Stable per city so repeated lookups look like real data
+            rng = random.Random(city.casefold())
+            self._send(200, {
+                "cod": 200,
+                "name": city.title(),
+                "main": {"temp": round(rng.uniform(-5, 35), 1)},
+                "weather": [{"description": rng.choice(CONDITIONS)}],
+            })
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, fail_rate=0.0):
+    """Starts a stub server on a background thread and returns it (use `.url`, `.shutdown()`)."""
+    server = StubWeatherServer((host, port), latency=latency, jitter=jitter, fail_rate=fail_rate)
+    thread = threading.Thread(target=server.serve_forever, name="stub-weather", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenWeatherMap server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="base delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay up to this many seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with HTTP 503")
+    args = parser.parse_args()
+
+    server = StubWeatherServer((args.host, args.port), latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate)
+    print(f"Stub weather server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# app.py opens its databases and key file at import time: keep them out of the checkout
+_scratch = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ.setdefault("PREFERENCE_DB_FILE", os.path.join(_scratch, "user_data.db"))
+os.environ.setdefault("SECRET_KEY", "tests")
+os.environ.setdefault("WEATHER_PREFETCH_ENABLED", "0")
+os.environ.setdefault("METRICS_ENABLED", "0")
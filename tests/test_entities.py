@@ -0,0 +1,28 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="module", autouse=True)
+def models():
+    app.load_models()
+
+
+def test_listed_city_missing_from_gazetteer_is_reported():
+    entities = app.extract_entities("weather in Paris, Berlin and Atlantis", "get_weather")
+    assert entities["cities"][:2] == ["Paris", "Berlin"]
+    assert entities["unrecognized_cities"] == ["Atlantis"]
+    assert "Atlantis" in app.unrecognized_cities_note(entities)
+
+
+def test_known_cities_skip_ner():
+    analysis = app.MessageAnalysis("what's the weather in london, thank you")
+    assert app.extract_entities(analysis.text, "get_weather", analysis) == {"city": "London", "cities": ["London"]}
+    assert analysis._doc is None
+
+
+def test_ner_fills_in_the_missing_meeting_half():
+    assert app.extract_entities("next week at 3pm", "schedule_meeting") == {"date": "next week", "time": "3pm"}
+    analysis = app.MessageAnalysis("tomorrow at 3pm")
+    assert analysis.meeting_details == ("tomorrow", "3pm")
+    assert analysis._doc is None
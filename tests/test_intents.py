@@ -0,0 +1,32 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope="module", autouse=True)
+def models():
+    app.load_models()
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("what's the weather in london", "get_weather"),
+    ("thank you", "thank_you"),
+    ("help me", "agent_capabilities"),
+    ("what are you", "about_agent"),
+    # A task keyword beats small talk in the same message
+    ("what's the weather in london, thank you", "get_weather"),
+    ("help me check the weather in Paris", "get_weather"),
+    ("can you help me with the weather in London", "get_weather"),
+    ("what are you doing tomorrow? schedule a meeting", "schedule_meeting"),
+    ("hi! book a meeting for friday at 3pm", "schedule_meeting"),
+    ("thanks, remember my city: Rome", "set_preferred_city"),
+])
+def test_recognize_intent(message, intent):
+    assert app.recognize_intent_spacy(message)[0] == intent
+
+
+def test_confidence_reflects_coverage():
+    _, full = app.recognize_intent_spacy("weather")
+    _, partial = app.recognize_intent_spacy("could you tell me the weather over there")
+    assert full == 1.0
+    assert 0.5 < partial < full
@@ -0,0 +1,30 @@
+import json
+
+from preference_store import LEGACY_USER_ID, PreferenceStore
+
+
+def make_store(tmp_path, legacy=None):
+    legacy_path = tmp_path / "user_data.json"
+    if legacy is not None:
+        legacy_path.write_text(json.dumps(legacy))
+    return PreferenceStore(str(tmp_path / "user_data.db"), legacy_json_path=str(legacy_path))
+
+
+def test_legacy_preferences_go_only_to_the_named_owner(tmp_path):
+    store = make_store(tmp_path, {"preferred_weather_city": "Oslo"})
+    assert store.load("stranger") == {}
+
+    store.save("owner", {"theme": "dark"})
+    store.flush()
+    assert store.claim_legacy("owner") == 1
+    assert store.load("owner") == {"theme": "dark", "preferred_weather_city": "Oslo"}
+    assert store.load(LEGACY_USER_ID) == {}
+    assert store.claim_legacy("someone_else") == 0
+
+
+def test_other_process_sees_flushed_changes(tmp_path):
+    first, second = make_store(tmp_path), make_store(tmp_path)
+    assert second.load("user") == {}
+    first.save("user", {"preferred_weather_city": "Rome"})
+    first.flush()
+    assert second.load("user") == {"preferred_weather_city": "Rome"}
@@ -0,0 +1,112 @@
+"""WeatherClient and WeatherPrefetcher against the local stub server (stub_weather_server.py)."""
+import threading
+import time
+
+import pytest
+
+from stub_weather_server import start_stub_server
+from weather_client import CircuitBreaker, WeatherClient
+from weather_prefetch import WeatherPrefetcher
+
+
+@pytest.fixture
+def stub():
+    server = start_stub_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(stub, **kwargs):
+    kwargs.setdefault("connect_timeout", 1)
+    kwargs.setdefault("read_timeout", 2)
+    return WeatherClient("test-key", stub.url, **kwargs)
+
+
+def test_breaker_opens_short_circuits_and_closes_after_a_good_trial(stub):
+    client = make_client(stub, failure_threshold=2, reset_timeout=0.2)
+    stub.fail_rate = 1.0
+    assert client.get_weather("Paris")["conditions"] == "error"
+    assert client.get_weather("Paris")["conditions"] == "error"
+    assert client.breaker.state == "open"
+
+    calls = stub.request_count
+    assert client.get_weather("Paris")["conditions"] == "error"
+    assert stub.request_count == calls
+    assert client.stats()["short_circuited"] == 1
+
+    time.sleep(0.25)
+    stub.fail_rate = 0.0
+    assert client.get_weather("Paris")["temperature"] != "N/A"
+    assert client.breaker.state == "closed"
+
+
+def test_failed_half_open_trial_reopens_the_breaker(stub):
+    client = make_client(stub, failure_threshold=1, reset_timeout=0.2)
+    stub.fail_rate = 1.0
+    client.get_weather("Paris")
+    time.sleep(0.25)
+    client.get_weather("Paris")
+    assert client.breaker.state == "open"
+    assert stub.request_count == 2
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_concurrent_misses_share_one_upstream_call(stub):
+    client = make_client(stub)
+    stub.latency = 0.2
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.get_weather("Paris"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stub.request_count == 1
+    assert len({result["temperature"] for result in results}) == 1
+    assert client.stats()["coalesced"] == 7
+
+
+def test_lookups_missing_the_deadline_are_cancelled(stub):
+    client = make_client(stub, max_workers=1)
+    stub.latency = 0.3
+    started = time.monotonic()
+    results, timed_out = client.get_weather_many(["Paris", "Berlin", "Rome"], deadline=0.1)
+    assert time.monotonic() - started < 0.25
+    assert results == [] and timed_out == ["Paris", "Berlin", "Rome"]
+
+    # Only the lookup already running reaches upstream; the queued ones never start
+    time.sleep(0.5)
+    assert stub.request_count == 1
+    results, timed_out = client.get_weather_many(["Oslo"], deadline=1.0)
+    assert [result["city"] for result in results] == ["Oslo"] and timed_out == []
+
+
+def test_prefetch_respects_max_rate_and_skips_fresh_entries(stub):
+    client = make_client(stub)
+    cities = ["Paris", "Berlin", "Rome", "Oslo", "Madrid"]
+    prefetcher = WeatherPrefetcher(client, city_source=lambda: cities, max_rate=10.0, jitter=0)
+    started = time.monotonic()
+    assert prefetcher.run_once() == 5
+    assert time.monotonic() - started >= 0.4  # 4 gaps of 1 / max_rate
+    assert stub.request_count == 5
+
+    assert prefetcher.run_once() == 0
+    assert stub.request_count == 5
+    assert prefetcher.stats()["skipped_fresh"] == 5
+
+
+def test_prefetch_round_stops_at_the_first_upstream_error(stub):
+    client = make_client(stub)
+    stub.fail_rate = 1.0
+    prefetcher = WeatherPrefetcher(client, city_source=lambda: ["Paris", "Berlin", "Rome"], max_rate=0, jitter=0)
+    assert prefetcher.run_once() == 0
+    assert stub.request_count == 1
+    assert prefetcher.stats()["failed"] == 1
@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def normalize_city(city):
+    """Cache key for a city name: trimmed, single-spaced and case-folded."""
+    return " ".join(city.split()).casefold()
+
+
+class _Flight:
+    """An upstream fetch in progress that other callers can wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing upstream for a while.
+
+    closed    -> calls go through; `failure_threshold` consecutive failures open it
+    open      -> calls are refused until `reset_timeout` seconds have passed
+    half_open -> one trial call is let through; success closes, failure re-opens
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may be made now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class WeatherClient:
+    """
+    OpenWeatherMap client with a bounded TTL/LRU cache in front of it.
+
+    - Successful lookups are cached for `cache_ttl` seconds.
+    - "City not found" answers are cached for `negative_ttl` seconds.
+    - Network/API errors are never cached.
+    - Concurrent misses for the same city share a single upstream call.
+    - All calls go through one pooled requests.Session with timeouts.
+    - A circuit breaker refuses upstream calls while OpenWeatherMap is failing,
+      so callers get an immediate "error" instead of waiting on a timeout.
+    - Multi-city lookups fan out on a bounded worker pool under one deadline.
+    """
+    def __init__(self, api_key, base_url, cache_ttl=600, negative_ttl=60, max_entries=1024,
+                 connect_timeout=3.05, read_timeout=5.0, pool_size=10,
+                 max_workers=8, failure_threshold=5, reset_timeout=30.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.max_workers = max_workers
+
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._cache = OrderedDict()  # key -> (expires_at, result)
+        self._open_resources()
+        # Pooled sockets and worker threads don't survive fork(); give each
+        # forked worker its own (the cache itself is inherited copy-on-write)
+        os.register_at_fork(after_in_child=self._open_resources)
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "upstream_calls": 0, "upstream_errors": 0,
+                       "short_circuited": 0, "deadline_misses": 0, "refreshes": 0}
+
+    def _open_resources(self):
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="weather")
+        self._inflight = {}          # key -> _Flight
+        self._lock = threading.Lock()
+
+    def get_weather(self, city):
+        """Returns the weather dict for a city, from cache when possible."""
+        key = normalize_city(city)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return dict(cached[1])
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                flight = self._inflight[key] = _Flight()
+                self._stats["misses"] += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            return dict(flight.result)
+
+        result = {"city": city, "temperature": "N/A", "conditions": "error"}
+        try:
+            result = self.fetch(city)
+        finally:
+            with self._lock:
+                self._store(key, result)
+                del self._inflight[key]
+            flight.result = result
+            flight.done.set()
+        return dict(result)
+
+    def get_weather_many(self, cities, deadline):
+        """
+        Looks up several cities concurrently, waiting at most `deadline` seconds overall.
+        Returns (results, timed_out): results in input order for the cities that
+        finished in time, and the cities that did not. Lookups that missed the
+        deadline and haven't started yet are cancelled, so later turns don't
+        queue behind work whose results would be dropped.
+        """
+        futures = [(city, self.executor.submit(self.get_weather, city)) for city in cities]
+        wait([future for _, future in futures], timeout=deadline)
+        results, timed_out = [], []
+        for city, future in futures:
+            if future.done() and not future.cancelled():
+                results.append(future.result())
+            else:
+                future.cancel()
+                timed_out.append(city)
+        if timed_out:
+            with self._lock:
+                self._stats["deadline_misses"] += len(timed_out)
+        return results, timed_out
+
+    def refresh(self, city):
+        """
+        Fetches a city upstream and replaces its cache entry, even if it has not
+        expired yet (used by the prefetcher). Requests arriving meanwhile wait for
+        this call instead of making their own. Returns None, without calling
+        upstream, if a fetch for the city is already in flight.
+        """
+        key = normalize_city(city)
+        with self._lock:
+            if key in self._inflight:
+                return None
+            flight = self._inflight[key] = _Flight()
+            self._stats["refreshes"] += 1
+
+        result = {"city": city, "temperature": "N/A", "conditions": "error"}
+        try:
+            result = self.fetch(city)
+        finally:
+            with self._lock:
+                self._store(key, result)
+                del self._inflight[key]
+            flight.result = result
+            flight.done.set()
+        return dict(result)
+
+    def ttl_remaining(self, city):
+        """Seconds until the cached entry for a city expires (None if there is no live entry)."""
+        with self._lock:
+            cached = self._cache.get(normalize_city(city))
+        if cached is None:
+            return None
+        remaining = cached[0] - time.monotonic()
+        return remaining if remaining > 0 else None
+
+    def fetch(self, city):
+        """Calls OpenWeatherMap directly, bypassing the cache."""
+        params = {
+            "q": city,
+            "appid": self.api_key,
+            "units": "metric"
+        }
+        if not self.breaker.allow():
+            with self._lock:
+                self._stats["short_circuited"] += 1
+            return {"city": city, "temperature": "N/A", "conditions": "error"}
+        with self._lock:
+            self._stats["upstream_calls"] += 1
+        try:
+            response = self.http.get(self.base_url, params=params, timeout=self.timeout)
+            if response.status_code == 404:
+                self.breaker.record_success()
+                print(f"OpenWeatherMap API error for {city}: city not found")
+                return {"city": city, "temperature": "N/A", "conditions": "unknown"}
+            response.raise_for_status()
+            weather_data = response.json()
+            self.breaker.record_success()
+
+            if weather_data.get("cod") == 200:
+                temp = weather_data["main"]["temp"]
+                conditions = weather_data["weather"][0]["description"]
+                city_name = weather_data["name"]
+                return {"city": city_name, "temperature": f"{temp}°C", "conditions": conditions}
+            else:
+                print(f"OpenWeatherMap API error for {city}: {weather_data.get('message', 'Unknown error')}")
+                return {"city": city, "temperature": "N/A", "conditions": "unknown"}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.breaker.record_failure()
+            with self._lock:
+                self._stats["upstream_errors"] += 1
+            print(f"Network or API Key Error fetching weather data for {city}: {e}")
+            return {"city": city, "temperature": "N/A", "conditions": "error"}
+
+    def _store(self, key, result):
+        """Caches a result according to its outcome. Caller must hold the lock."""
+        if result["conditions"] == "error":
+            return
+        ttl = self.negative_ttl if result["temperature"] == "N/A" else self.cache_ttl
+        if ttl <= 0:
+            return
+        self._cache[key] = (time.monotonic() + ttl, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """Snapshot of cache counters, useful for sizing max_entries and the TTLs."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._cache)
+            stats["max_entries"] = self.max_entries
+        stats["circuit_state"] = self.breaker.state
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
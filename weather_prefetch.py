@@ -0,0 +1,149 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from weather_client import normalize_city
+
+
+class WeatherPrefetcher:
+    """
+    Keeps weather for likely cities warm in a WeatherClient's cache.
+
+    Every `interval` seconds (± `jitter`), a background thread refreshes each
+    city whose cache entry is missing or expires within `refresh_ahead`
+    seconds. The cities are the recently requested ones (see track(), kept for
+    `recent_ttl` seconds) plus whatever `city_source()` returns (e.g. users'
+    preferred cities), at most `max_cities` per round, recent ones first.
+    Upstream calls are spaced at least 1 / `max_rate` seconds apart, and a
+    round stops at the first upstream error (including an open circuit breaker).
+    """
+    def __init__(self, client, city_source=None, interval=60.0, refresh_ahead=120.0, max_rate=2.0,
+                 jitter=0.1, recent_ttl=3600.0, max_cities=200):
+        self.client = client
+        self.city_source = city_source
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.max_rate = max_rate
+        self.jitter = jitter
+        self.recent_ttl = recent_ttl
+        self.max_cities = max_cities
+        self._recent = OrderedDict()  # normalized city -> (last requested at, city)
+        self._unknown = set()         # normalized cities OpenWeatherMap doesn't know
+        self._lock = threading.Lock()
+        self._stats = {"rounds": 0, "refreshed": 0, "skipped_fresh": 0, "failed": 0}
+        self._thread = None
+        self._stop = threading.Event()
+        # The refresh thread does not survive fork(); a forked worker calls start() again
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def track(self, city):
+        """Records that a user just got the weather for `city`."""
+        key = normalize_city(city)
+        if not key:
+            return
+        with self._lock:
+            self._recent[key] = (time.monotonic(), city)
+            self._recent.move_to_end(key)
+            self._unknown.discard(key)
+            while len(self._recent) > self.max_cities:
+                self._recent.popitem(last=False)
+
+    def cities(self):
+        """The cities the next round will consider, most recently requested first."""
+        cutoff = time.monotonic() - self.recent_ttl
+        with self._lock:
+            while self._recent:
+                key, (requested_at, _) = next(iter(self._recent.items()))
+                if requested_at >= cutoff:
+                    break
+                del self._recent[key]
+            candidates = [city for _, city in reversed(self._recent.values())]
+            unknown = set(self._unknown)
+        if self.city_source is not None:
+            try:
+                candidates.extend(sorted(self.city_source()))
+            except Exception as e:
+                print(f"Weather prefetch: could not read preferred cities: {e}")
+
+        seen, cities = set(), []
+        for city in candidates:
+            key = normalize_city(city)
+            if key and key not in seen and key not in unknown:
+                seen.add(key)
+                cities.append(city)
+                if len(cities) >= self.max_cities:
+                    break
+        return cities
+
+    def run_once(self):
+        """One refresh round. Returns the number of cities fetched upstream."""
+        refreshed = 0
+        last_call = None
+        for city in self.cities():
+            if self._stop.is_set():
+                break
+            remaining = self.client.ttl_remaining(city)
+            if remaining is not None and remaining > self.refresh_ahead:
+                self._count("skipped_fresh")
+                continue
+            if last_call is not None and self.max_rate > 0:
+                delay = 1.0 / self.max_rate - (time.monotonic() - last_call)
+                if delay > 0 and self._stop.wait(delay):
+                    break
+            last_call = time.monotonic()
+            result = self.client.refresh(city)
+            if result is None:
+                continue
+            if result["conditions"] == "error":
+                # Upstream is failing (or the circuit breaker is open); try again next round
+                self._count("failed")
+                break
+            refreshed += 1
+            self._count("refreshed")
+            if result["temperature"] == "N/A":
+                with self._lock:
+                    self._unknown.add(normalize_city(city))
+        self._count("rounds")
+        return refreshed
+
+    def start(self):
+        """Starts the background refresh thread (once per process)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="weather-prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        # Random start delay (and per-round jitter) so forked workers don't refresh in lockstep
+        delay = random.uniform(0, self.interval * self.jitter) if self.jitter else 0
+        while not self._stop.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Weather prefetch round failed: {e}")
+            delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked_cities"] = len(self._recent)
+        stats["running"] = self._thread is not None and self._thread.is_alive()
+        return stats